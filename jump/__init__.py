@@ -1,5 +1,6 @@
 from .engine import Engine, RuntimeError
 from .compiler import Compiler, CompileError
+from .loaders import FileSystemLoader, DictLoader, PackageLoader
 
 _DefaultEngine = Engine()
 
@@ -16,6 +17,14 @@ def parse_path(path, **options):
     return _DefaultEngine.parse_path(path, **options)
 
 
+def check_paths(paths, workers=None, translate=False, **options):
+    return _DefaultEngine.check_paths(paths, workers, translate, **options)
+
+
+def reparse(tree, offset, removed, inserted):
+    return _DefaultEngine.reparse(tree, offset, removed, inserted)
+
+
 def translate(text, **options):
     return _DefaultEngine.translate(text, **options)
 
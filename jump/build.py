@@ -0,0 +1,169 @@
+"""Ahead-of-time template compiler.
+
+Translates a directory of templates into a python package, one module per template::
+
+    python -m jump.build [--pattern '*.jump'] [--engine module:Class] src_dir out_dir
+
+The generated package maps template paths (relative to `src_dir`) to render functions::
+
+    import out_dir
+
+    out_dir.render('pages/index.jump', args)
+    fn = out_dir.get('pages/index.jump')
+"""
+
+import argparse
+import fnmatch
+import importlib
+import os
+import re
+import sys
+
+from . import compiler
+from .engine import Engine
+
+DEFAULT_PATTERNS = ['*.jump', '*.tpl']
+
+MODULE_TEMPLATE = """\
+# generated by jump.build from $path$
+
+from . import include as _INCLUDE
+
+# embedded files are read from the file system
+_LOADER = None
+
+$code$
+"""
+
+INDEX_TEMPLATE = """\
+# generated by jump.build
+
+import importlib
+
+TEMPLATES = $templates$
+
+# included paths, as resolved at build time => template paths
+INCLUDES = $includes$
+
+
+def get(path):
+    \"\"\"Return the compiled function for a template path.\"\"\"
+
+    return importlib.import_module('.' + TEMPLATES[path], __name__).render
+
+
+def include(path):
+    \"\"\"Return the compiled function for a template included in the 'call' mode.\"\"\"
+
+    return get(INCLUDES[path])
+
+
+def render(path, args=None, error=None, engine=None):
+    if engine is None:
+        import jump
+        engine = jump.engine()
+    return engine.call(get(path), args, error)
+"""
+
+
+def build(src_dir, out_dir, patterns=None, eng=None, **options):
+    """Compile templates from `src_dir` into a package in `out_dir`.
+
+    Returns a list of `CompileError` objects, the package index contains only templates that compiled successfully.
+    """
+
+    eng = eng or Engine()
+    options['name'] = 'render'
+
+    templates = {}
+    includes = {}
+    errors = []
+
+    queue = [(rel_path, os.path.join(src_dir, rel_path)) for rel_path in find_templates(src_dir, patterns or DEFAULT_PATTERNS)]
+    queued = {rel_path for rel_path, _ in queue}
+
+    while queue:
+        rel_path, path = queue.pop(0)
+        cc = compiler.Compiler(eng, options)
+        try:
+            python = cc.run('translate', None, path)
+        except compiler.CompileError as exc:
+            errors.append(exc)
+            continue
+
+        if cc.options.include_mode == 'call':
+            # included templates are called at run time, build them as well
+            for inc_path in cc.resolved.values():
+                inc_rel_path = os.path.relpath(inc_path, src_dir).replace(os.sep, '/')
+                includes[inc_path] = inc_rel_path
+                if inc_rel_path not in queued:
+                    queued.add(inc_rel_path)
+                    queue.append((inc_rel_path, inc_path))
+
+        mod = _module_name(rel_path, templates.values())
+        _write(os.path.join(out_dir, mod + '.py'), MODULE_TEMPLATE.replace('$path$', rel_path).replace('$code$', python))
+        templates[rel_path] = mod
+
+    index = INDEX_TEMPLATE.replace('$templates$', _format_dict(templates)).replace('$includes$', _format_dict(includes))
+    _write(os.path.join(out_dir, '__init__.py'), index)
+    return errors
+
+
+def find_templates(src_dir, patterns):
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(src_dir):
+        dirnames.sort()
+        for fn in sorted(filenames):
+            if any(fnmatch.fnmatch(fn, p) for p in patterns):
+                rel_path = os.path.relpath(os.path.join(dirpath, fn), src_dir)
+                paths.append(rel_path.replace(os.sep, '/'))
+    return paths
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog='python -m jump.build', description='Compile templates into a python package.')
+    ap.add_argument('src_dir', help='template directory')
+    ap.add_argument('out_dir', help='package directory to create')
+    ap.add_argument('--pattern', action='append', help='template file name pattern (default: *.jump, *.tpl)')
+    ap.add_argument('--engine', help='custom engine class, as module:ClassName')
+    args = ap.parse_args(argv)
+
+    eng = None
+    if args.engine:
+        mod, _, cls = args.engine.partition(':')
+        eng = getattr(importlib.import_module(mod), cls)()
+
+    errors = build(args.src_dir, args.out_dir, args.pattern, eng)
+    for exc in errors:
+        print(exc.message, file=sys.stderr)
+    return 1 if errors else 0
+
+
+##
+
+
+def _module_name(rel_path, used):
+    name = re.sub(r'\W', '_', rel_path)
+    if not name or name[0].isdigit():
+        name = '_' + name
+    base, n = name, 1
+    while name in used:
+        n += 1
+        name = base + '_' + str(n)
+    return name
+
+
+def _format_dict(d):
+    if not d:
+        return '{}'
+    return '{\n' + ''.join(f'    {k!r}: {v!r},\n' for k, v in d.items()) + '}'
+
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wt', encoding='utf8') as fp:
+        fp.write(text)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
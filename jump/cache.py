@@ -0,0 +1,417 @@
+"""Compiled template cache"""
+
+import glob
+import hashlib
+import importlib.util
+import itertools
+import logging
+import marshal
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from . import compiler
+
+log = logging.getLogger('jump')
+
+
+class Entry:
+    def __init__(self, fn, deps, loader, source=None):
+        self.fn = fn
+        self.deps = deps
+        self.loader = loader
+        # (options, text, path) to recompile the template
+        self.source = source
+
+    def is_valid(self):
+        for path, v in self.deps.items():
+            if compiler.version(self.loader, path) != v:
+                return False
+        return True
+
+
+class MemoryCache:
+    """Thread-safe LRU cache of compiled template functions.
+
+    Each entry records the files the template was compiled from,
+    and is dropped on lookup once any of them has changed,
+    unless `check` is False (when a `Watcher` takes care of changes).
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.check = True
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        e = self.lookup(key, self.check)
+        return e.fn if e else None
+
+    def lookup(self, key, check):
+        """Return the entry for a key, checking if it's stale when `check` is true."""
+
+        with self.lock:
+            e = self.entries.get(key)
+            if e is None:
+                self.misses += 1
+                return None
+
+        # check outside the lock, stat'ing files can be slow
+        if check and not e.is_valid():
+            with self.lock:
+                if self.entries.get(key) is e:
+                    del self.entries[key]
+                self.misses += 1
+            return None
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            self.hits += 1
+        return e
+
+    def put(self, key, fn, deps=None, loader=None, source=None):
+        if self.size <= 0:
+            return
+        if deps and any(v is None for v in deps.values()):
+            # cannot be validated later, see `compiler.version`
+            return
+        with self.lock:
+            self.entries[key] = Entry(fn, deps or {}, loader, source)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def replace(self, key, old, new):
+        with self.lock:
+            if self.entries.get(key) is old:
+                self.entries[key] = new
+
+    def items(self):
+        with self.lock:
+            return list(self.entries.items())
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self.lock:
+            return dict(hits=self.hits, misses=self.misses, size=len(self.entries), maxsize=self.size)
+
+
+class BlobCache:
+    """Thread-safe cache of `@embed`ded file contents, reloaded when the file version changes."""
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, loader, path):
+        key = loader, path
+        v = compiler.version(loader, path)
+        with self.lock:
+            e = self.entries.get(key)
+        if e and v is not None and e[0] == v:
+            return e[1]
+
+        text = _read_blob(loader, path)
+        if v is not None:
+            with self.lock:
+                self.entries[key] = v, text
+        return text
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class Watcher(threading.Thread):
+    """Background thread that recompiles changed templates in the engine cache.
+
+    New functions are swapped in when ready, a template that fails to compile keeps its previous function.
+    """
+
+    def __init__(self, engine, interval):
+        super().__init__(name='jump-watcher', daemon=True)
+        self.engine = engine
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def stop(self):
+        self.stopped.set()
+        if self.is_alive() and self is not threading.current_thread():
+            self.join()
+
+    def check(self):
+        for key, e in self.engine.cache.items():
+            try:
+                self.check_entry(key, e)
+            except Exception:
+                # e.g. a failing loader, the watcher keeps running and the entry is checked again next time
+                log.exception('jump: cannot check %s', e.source and e.source[2] or '<string>')
+
+    def check_entry(self, key, e):
+        if e.source is None or e.is_valid():
+            return
+
+        options, text, path = e.source
+        try:
+            fn, deps, loader = self.engine.compile_source(options, text, path)
+        except compiler.CompileError as exc:
+            log.error('jump: cannot recompile %s: %s', path or '<string>', exc.message)
+            # keep serving the old function until the next change
+            deps = {p: compiler.version(e.loader, p) for p in e.deps}
+            self.engine.cache.replace(key, e, Entry(e.fn, deps, e.loader, e.source))
+            return
+
+        self.engine.cache.replace(key, e, Entry(fn, deps, loader, e.source))
+
+
+class DiskCache:
+    """Persistent cache of marshalled template code objects.
+
+    Entries are keyed by the compiler version, options, engine commands and the template source.
+    Each entry stores the included files along with their versions and digests,
+    an entry is stale when any of them has changed.
+    """
+
+    FORMAT = 1
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def compile(self, cc: compiler.Compiler, text, path):
+        """Return a template function and its dependencies, loading the code from the cache if possible."""
+
+        text, path = cc.source(text, path)
+        file_path = os.path.join(self.directory, self.key(cc, text, path) + '.jumpc')
+
+        res = self.load(file_path, cc.options.loader)
+        if res:
+            code, deps = res
+            cc.deps.update(deps)
+            return cc.compile(code), cc.deps
+
+        python = cc.run('translate', text, path)
+        code = compile(python, '<string>', 'exec')
+        self.store(file_path, code, cc)
+        return cc.compile(code), cc.deps
+
+    def key(self, cc, text, path):
+        h = hashlib.sha256(_fingerprint())
+        h.update(repr(_engine_signature(cc.engine)).encode('utf8'))
+        h.update(repr(_options_signature(vars(cc.options))).encode('utf8'))
+        h.update(repr(path).encode('utf8'))
+        h.update(text.encode('utf8'))
+        return h.hexdigest()
+
+    def load(self, file_path, loader):
+        try:
+            with open(file_path, 'rb') as fp:
+                fmt, dep_list, code = marshal.load(fp)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # corrupt or foreign entry, will be overwritten
+            return None
+
+        if fmt != self.FORMAT:
+            return None
+
+        deps = {}
+        for path, v, digest in dep_list:
+            cur = compiler.version(loader, path)
+            if cur != v and (callable(loader) or _file_digest(path) != digest):
+                return None
+            deps[path] = cur
+
+        return code, deps
+
+    def store(self, file_path, code, cc):
+        dep_list = []
+        for path, v in cc.deps.items():
+            if v is None:
+                # cannot be validated later
+                return
+            dep_list.append((path, v, _digest(cc.texts[path])))
+
+        try:
+            data = marshal.dumps((self.FORMAT, dep_list, code))
+        except ValueError:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+            os.replace(tmp, file_path)
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+
+class PreloadResult:
+    def __init__(self, path, time, error):
+        self.path = path
+        self.time = time
+        self.error = error
+
+    def __repr__(self):
+        return f'PreloadResult({self.path!r}, {self.time:.4f}, {self.error!r})'
+
+
+def preload(engine, paths, workers, options):
+    """Compile templates in a process pool and put them into the engine cache."""
+
+    if isinstance(paths, str):
+        paths = [paths]
+    paths = [p for pattern in paths for p in sorted(glob.glob(pattern, recursive=True)) or [pattern]]
+
+    args = itertools.repeat(type(engine)), itertools.repeat(options), paths
+    if workers == 0 or len(paths) < 2:
+        res = list(map(_translate_path, *args))
+    else:
+        with ProcessPoolExecutor(workers) as ex:
+            chunk = max(1, len(paths) // ((workers or os.cpu_count() or 1) * 4))
+            res = list(ex.map(_translate_path, *args, chunksize=chunk))
+
+    results = []
+
+    for path, (python, deps, t, err) in zip(paths, res):
+        if err:
+            results.append(PreloadResult(path, t, err))
+            continue
+        t0 = time.perf_counter()
+        cc = compiler.Compiler(engine, options)
+        cc.deps.update(deps)
+        try:
+            fn = cc.compile(python)
+        except Exception as exc:
+            results.append(PreloadResult(path, t + time.perf_counter() - t0, exc))
+            continue
+        key = path_key(path, options)
+        if key is not None:
+            engine.cache.put(key, fn, cc.deps, cc.options.loader, (options, None, path))
+        results.append(PreloadResult(path, t + time.perf_counter() - t0, None))
+
+    return results
+
+
+def _translate_path(engine_class, options, path):
+    t = time.perf_counter()
+    try:
+        cc = compiler.Compiler(engine_class(), options)
+        python = cc.run('translate', None, path)
+    except Exception as exc:
+        # also loader and engine errors, one failed template doesn't abort the batch
+        return None, {}, time.perf_counter() - t, exc
+    return python, cc.deps, time.perf_counter() - t, None
+
+
+def text_key(text, options):
+    opts = options_key(options)
+    if opts is not None:
+        # str hashes are cached by the interpreter, so the source itself is a cheap key
+        return 'text', text, opts
+
+
+def path_key(path, options):
+    opts = options_key(options)
+    if opts is not None:
+        return 'path', path, opts
+
+
+def options_key(options):
+    opts = dict(compiler.C.DEFAULT_OPTIONS)
+    opts.update(options)
+    key = tuple(sorted(opts.items()))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+##
+
+_fingerprint_value = None
+
+
+def _fingerprint():
+    # any change in the compiler, the runtime the generated code calls, or the python version invalidates the disk cache
+    global _fingerprint_value
+    if _fingerprint_value is None:
+        h = hashlib.sha256(importlib.util.MAGIC_NUMBER)
+        for name in _FINGERPRINT_MODULES:
+            with open(os.path.join(os.path.dirname(compiler.__file__), name), 'rb') as fp:
+                h.update(fp.read())
+        _fingerprint_value = h.digest()
+    return _fingerprint_value
+
+
+_FINGERPRINT_MODULES = ('compiler.py', 'engine.py')
+
+
+def _engine_signature(engine):
+    cls = type(engine)
+    cmds = [a for a in dir(engine) if a.partition('_')[0] in compiler.C.DEF_COMMANDS]
+    # outputs of pure functions are folded into the code, so their implementation matters too
+    pure = [(a, _code_digest(getattr(cls, a))) for a in cmds if a.partition('_')[2] in engine.pure_functions]
+    return cls.__module__, cls.__qualname__, cmds, pure
+
+
+def _code_digest(fn):
+    code = getattr(fn, '__code__', None)
+    if code is None:
+        return getattr(fn, '__qualname__', repr(fn))
+    return hashlib.sha256(marshal.dumps(code)).hexdigest()
+
+
+def _options_signature(options):
+    sig = []
+    for k, v in sorted(options.items()):
+        if callable(v):
+            # only the kind of the loader matters, included files are validated separately
+            t = v if isinstance(v, type) or hasattr(v, '__qualname__') else type(v)
+            v = t.__module__ + '.' + t.__qualname__
+        sig.append((k, v))
+    return sig
+
+
+def _read_blob(loader, path):
+    if not callable(loader):
+        with open(path, 'rt', encoding='utf8') as fp:
+            return fp.read()
+    read = getattr(loader, 'read', None)
+    if read:
+        # path is already resolved
+        return read(path)
+    return loader(None, path)[0]
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode('utf8')).digest()
+
+
+def _file_digest(path):
+    try:
+        with open(path, 'rt', encoding='utf8') as fp:
+            return _digest(fp.read())
+    except OSError:
+        return None
@@ -0,0 +1,89 @@
+"""Template validation.
+
+Parses many templates in a process pool and reports all errors, not just the first one in each template::
+
+    python -m jump.check [--translate] [--workers N] [--engine module:Class] path_or_dir ...
+
+Directories are searched for templates like in `jump.build`, other arguments can be glob patterns.
+"""
+
+import argparse
+import glob
+import importlib
+import itertools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from . import compiler
+
+
+def check_paths(engine, paths, workers=None, translate=False, options=None):
+    """Check templates and return a list of `CompileError` objects, ordered by path and line.
+
+    A template with an error is parsed further from the next line, so several errors can be reported for it.
+    With `translate`, templates without syntax errors are also translated to python.
+    """
+
+    options = options or {}
+    paths = expand_paths(paths)
+
+    args = itertools.repeat(type(engine)), itertools.repeat(options), itertools.repeat(translate), paths
+    if workers == 0 or len(paths) < 2:
+        res = list(map(_check_path, *args))
+    else:
+        with ProcessPoolExecutor(workers) as ex:
+            chunk = max(1, len(paths) // ((workers or os.cpu_count() or 1) * 4))
+            res = list(ex.map(_check_path, *args, chunksize=chunk))
+
+    return [exc for errors in res for exc in errors]
+
+
+def expand_paths(paths):
+    # build imports the engine, which imports this module
+    from . import build
+
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+
+    res = []
+    for p in paths:
+        p = os.fspath(p)
+        if os.path.isdir(p):
+            res.extend(os.path.join(p, rel_path) for rel_path in build.find_templates(p, build.DEFAULT_PATTERNS))
+        else:
+            res.extend(sorted(glob.glob(p, recursive=True)) or [p])
+    return res
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog='python -m jump.check', description='Check templates for errors.')
+    ap.add_argument('paths', nargs='+', help='template files, directories or glob patterns')
+    ap.add_argument('--translate', action='store_true', help='also translate templates to python')
+    ap.add_argument('--workers', type=int, help='number of worker processes, 0 to check serially')
+    ap.add_argument('--engine', help='custom engine class, as module:ClassName')
+    args = ap.parse_args(argv)
+
+    if args.engine:
+        mod, _, cls = args.engine.partition(':')
+        eng = getattr(importlib.import_module(mod), cls)()
+    else:
+        import jump
+        eng = jump.engine()
+
+    errors = check_paths(eng, args.paths, args.workers, args.translate)
+    for exc in errors:
+        print(exc.message, file=sys.stderr)
+    return 1 if errors else 0
+
+
+##
+
+
+def _check_path(engine_class, options, translate, path):
+    cc = compiler.Compiler(engine_class(), options)
+    return cc.check(None, path, translate)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,30 +1,63 @@
+import bisect
+import errno
+import operator
 import os
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 
 # public API
 
 def do(cmd, engine, options, text, path):
-    cc = Compiler(engine, options)
+    return Compiler(engine, options).run(cmd, text, path)
 
-    if text is None:
-        loc = Location(pos=0, path=__file__, line_num=1)
-        text, path = cc.load(None, path or cc.options.path, loc)
-    else:
-        path = path or cc.options.path or '<string>'
 
-    cc.buf.paste(text, path, cc.buf.pos)
+def reparse(engine, tree, offset, removed, inserted):
+    """Parse a template again after a text edit, reusing the unchanged parts of a `parse` result.
+
+    Replaces `removed` characters at `offset` with the `inserted` text.
+    Top-level nodes before the edit and after the point where parsing is back in sync are reused,
+    positions and line numbers of the latter are shifted in place, so `tree` shouldn't be used afterwards.
+    """
+
+    ps = tree.parse_state
+    if ps is None:
+        raise ValueError('not a parse result')
+    if offset < 0 or removed < 0 or offset + removed > len(ps.text):
+        raise ValueError('edit out of range')
+
+    text = ps.text[:offset] + inserted + ps.text[offset + removed:]
+
+    cc = Compiler(engine, ps.options)
+    if not ps.incremental:
+        return cc.run('parse', text, ps.path)
+
+    cc.buf.paste(text, ps.path, 0)
+    return TemplateParser(cc).reparse(tree, offset, removed, inserted)
 
-    node = cc.parse()
-    if cmd == 'parse':
-        return node
 
-    python = cc.translate(node)
-    if cmd == 'translate':
-        return python
+def fail_fast(template_fn):
+    """Return the fail-fast variant of a template function, or the function itself if it was compiled without one."""
 
-    fn = cc.compile(python)
-    if cmd == 'compile':
-        return fn
+    return getattr(template_fn, 'fail_fast', None) or template_fn
+
+
+def version(loader, path):
+    """Return a version token for a loaded path, used to check if compiled templates are stale.
+
+    Files are versioned by their mtime and size, custom loaders can provide a `version(path)` method.
+    Without it, the version is None, and templates loaded by the loader are not cached.
+    """
+
+    if callable(loader):
+        fn = getattr(loader, 'version', None)
+        return fn(path) if fn else None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
 
 
 ##
@@ -47,6 +80,11 @@ class C:
     IDENTIFIER_START = set('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_')
     IDENTIFIER_CONTINUE = set('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_0123456789')
 
+    RE_WS = re.compile('[ \r\t\x0b\f]*')
+    RE_WSNL = re.compile('[ \r\t\x0b\f\n]*')
+    RE_IDENTIFIER = re.compile('[A-Za-z0-9_]*')
+    RE_IN = re.compile('[ \r\t\x0b\f]*in(?![A-Za-z0-9_])')
+
     DIGIT_DEC = set('0123456789')
     DIGIT_HEX = set('0123456789ABCDEFabcdef')
     DIGIT_OCT = set('01234567')
@@ -86,6 +124,45 @@ class C:
 
     KEYWORD_OPS = {'and', 'or', 'not', 'in', 'is'}
 
+    # precedence levels of binary operators, 'not' is a prefix operator between 'and' and comparisons
+
+    OR_LEVEL = 1
+    AND_LEVEL = 2
+    NOT_LEVEL = 3
+    COMPARISON_LEVEL = 4
+    SUM_LEVEL = 5
+    PRODUCT_LEVEL = 6
+    POWER_LEVEL = 7
+
+    BINARY_LEVELS = {
+        'or': OR_LEVEL,
+        'and': AND_LEVEL,
+        **dict.fromkeys(COMPARE_OPS, COMPARISON_LEVEL),
+        **dict.fromkeys(ADD_OPS, SUM_LEVEL),
+        **dict.fromkeys(MUL_OPS, PRODUCT_LEVEL),
+        **dict.fromkeys(POWER_OP, POWER_LEVEL),
+    }
+
+    # operand names for error messages
+    BINARY_OPERANDS = {
+        OR_LEVEL: 'andexpr',
+        AND_LEVEL: 'notexpr',
+        COMPARISON_LEVEL: 'sum',
+        SUM_LEVEL: 'product',
+        PRODUCT_LEVEL: 'power',
+        POWER_LEVEL: 'unary',
+    }
+
+    # plain names, punctuation, decimal integers and strings without escapes,
+    # everything else is scanned by Lexer methods
+    RE_TOKEN = re.compile('|'.join([
+        '(?P<name>[A-Za-z_][A-Za-z0-9_]*)',
+        '(?P<punct>' + '|'.join(re.escape(p) for p in sorted(PUNCT, key=lambda p: (-len(p), p))) + ')',
+        '(?P<int>[0-9][0-9_]*)(?![0-9_.eExXoObB])',
+        '(?P<string>\'[^\'\\\\\\n]*\'|"[^"\\\\\\n]*")',
+        '(?P<newline>\\n)',
+    ]))
+
     KEYWORDS = {
         'and', 'as', 'assert', 'async', 'await', 'break', 'class', 'continue', 'def', 'del', 'elif',
         'else', 'except', 'finally', 'for', 'from', 'global', 'if', 'import', 'in', 'is', 'lambda',
@@ -98,12 +175,47 @@ class C:
 
     SAFE_FILTER = {'safe', 'none'}
 
+    # operators for expressions computed at compile time
+
+    FOLD_BINARY_OPS = {
+        '+': operator.add,
+        '-': operator.sub,
+        '*': operator.mul,
+        '/': operator.truediv,
+        '//': operator.floordiv,
+        '%': operator.mod,
+        '**': operator.pow,
+        '==': operator.eq,
+        '!=': operator.ne,
+        '<=': operator.le,
+        '<': operator.lt,
+        '>=': operator.ge,
+        '>': operator.gt,
+        'in': lambda a, b: a in b,
+        'not in': lambda a, b: a not in b,
+    }
+
+    FOLD_UNARY_OPS = {
+        '+': operator.pos,
+        '-': operator.neg,
+        'not': operator.not_,
+    }
+
+    # max length of a sequence or bit length of a number computed at compile time
+    FOLD_MAX_SIZE = 4096
+
+    # widths and precisions in format strings
+    RE_FOLD_FORMAT_SIZE = re.compile(r'\*|\d+')
+
     ELSE_SYMBOL = 'else'
     ELIF_SYMBOL = 'elif'
     END_SYMBOL = 'end'
 
     AUX_COMMANDS = {END_SYMBOL, ELSE_SYMBOL, ELIF_SYMBOL}
 
+    # commands that always have a body
+    BLOCK_COMMANDS = {'if', 'for', 'each', 'with', 'without'}
+
     DEF_COMMANDS = {'def', 'box', 'mdef', 'mbox'}
 
     TOK_TYPE = 0
@@ -117,6 +229,10 @@ class C:
         name='_RENDER_',
         filter=None,
         loader=None,
+        include_mode='paste',
+        prefetch=0,
+        fail_fast=False,
+        optimize=True,
         strip=False,
         escapes='@@ @ {{ { }} }',
         comment_symbol='@#',
@@ -135,20 +251,55 @@ class C:
 
     PY_MARKER = '##:'
 
+    # prefix for locals bound to engine functions and builtins once per render
+    PY_FREE_NAME = '_F_'
+
     PY_TEMPLATE = """\
 def $name$(_ENGINE, _ARGS, _ERRORHANDLER=None):
     _PATHS = $paths$
     _ENV = _ENGINE.environment(_PATHS, _ARGS, _ERRORHANDLER)
     _ = ARGS = _ENV.ARGS
+    _ADICT = ARGS.__dict__
     print =_ENV.print
     try:
         _ENV.pushbuf()
+        _APPEND = _ENV.buf[-1].append
         $code$
         return _ENV.popbuf()
     except Exception as _0:
         _ENV.error(_0, $loc$)
 """
 
+    # used when there's no error handler, errors are located by the python line number
+    PY_TEMPLATE_FAIL_FAST = """\
+def $name$(_ENGINE, _ARGS, _ERRORHANDLER=None):
+    _PATHS = $paths$
+    _ENV = _ENGINE.environment(_PATHS, _ARGS, _ERRORHANDLER)
+    _ = ARGS = _ENV.ARGS
+    _ADICT = ARGS.__dict__
+    print =_ENV.print
+    try:
+        _ENV.pushbuf()
+        _APPEND = _ENV.buf[-1].append
+        $code$
+        return _ENV.popbuf()
+    except Exception as _0:
+        _ENV.fail(_0, $lines$)
+"""
+
+    PY_FAIL_FAST_SUFFIX = '_fail_fast'
+
+    # max number of echoes written by one f-string, CPython compiles large f-strings in quadratic time
+    PY_MAX_RUN_VALUES = 32
+
+    # temporaries reused throughout a template function, nested loops and ifs add the depth
+    PY_EXC_VAR = '_E'
+    PY_ECHO_VAR = '_R'
+    PY_COND_VAR = '_B'
+    PY_RUN_VAR = '_V'
+    PY_LOOP_ITER_VAR = '_I'
+    PY_LOOP_COUNT_VAR = '_C'
+
 
 class Data:
     def __init__(self, **kwargs):
@@ -158,13 +309,16 @@ class Data:
         return None
 
 
-class Location(Data):
-    pos = 0
-    path = ''
-    path_index = 0
-    line_start_pos = 0
-    line_num = 0
-    column = 0
+class Location:
+    __slots__ = ('pos', 'path', 'path_index', 'line_start_pos', 'line_num', 'column')
+
+    def __init__(self, pos=0, path='', path_index=0, line_start_pos=0, line_num=0, column=0):
+        self.pos = pos
+        self.path = path
+        self.path_index = path_index
+        self.line_start_pos = line_start_pos
+        self.line_num = line_num
+        self.column = column
 
     def __repr__(self):
         return '[' + repr(self.path) + ',' + repr(self.line_num) + ']'
@@ -172,6 +326,8 @@ class Location(Data):
 
 class Node:
     class And:
+        __slots__ = ('subject', 'pairs')
+
         def __init__(self, subject, pairs):
             self.subject = subject
             self.pairs = pairs
@@ -180,6 +336,8 @@ class Node:
             return tr.emit_left_binary_op(self)
 
     class Argument:
+        __slots__ = ('name', 'star', 'expr')
+
         def __init__(self, name, star, expr):
             self.name = name
             self.star = star
@@ -196,6 +354,8 @@ class Node:
             return code
 
     class Attr:
+        __slots__ = ('subject', 'name')
+
         def __init__(self, subject, name):
             self.subject = subject
             self.name = name
@@ -216,6 +376,8 @@ class Node:
             return f'_ENV.attrs({head}, {names!r})'
 
     class Call:
+        __slots__ = ('function', 'args')
+
         def __init__(self, function, args):
             self.function = function
             self.args = args
@@ -228,6 +390,8 @@ class Node:
             return f'{fn}({args})'
 
     class Comparison:
+        __slots__ = ('subject', 'pairs')
+
         def __init__(self, subject, pairs):
             self.subject = subject
             self.pairs = pairs
@@ -236,6 +400,8 @@ class Node:
             return tr.emit_comp_binary_op(self)
 
     class Const:
+        __slots__ = ('value',)
+
         def __init__(self, value):
             self.value = value
 
@@ -243,6 +409,8 @@ class Node:
             return repr(self.value)
 
     class Dict:
+        __slots__ = ('items',)
+
         def __init__(self, items):
             self.items = items
 
@@ -250,6 +418,8 @@ class Node:
             return '{' + _comma(tr.emit(k) + ':' + tr.emit(v) for k, v in self.items) + '}'
 
     class IfExpression:
+        __slots__ = ('cond', 'yes', 'no')
+
         def __init__(self, cond, yes, no):
             self.cond = cond
             self.yes = yes
@@ -265,6 +435,8 @@ class Node:
             )
 
     class Index:
+        __slots__ = ('subject', 'index')
+
         def __init__(self, subject, index):
             self.subject = subject
             self.index = index
@@ -275,6 +447,8 @@ class Node:
             return f'{subj}[{index}]'
 
     class List:
+        __slots__ = ('items',)
+
         def __init__(self, items):
             self.items = items
 
@@ -282,6 +456,8 @@ class Node:
             return '[' + _comma(tr.emit(v) for v in self.items) + ']'
 
     class Name:
+        __slots__ = ('ident',)
+
         def __init__(self, ident):
             self.ident = ident
 
@@ -289,9 +465,13 @@ class Node:
             s = self.ident
             if s in tr.locals:
                 return s
-            return f'_ENV.get({s!r})'
+            # template args are looked up on each use, since they can be changed while rendering
+            tr.free_names[s] = True
+            return f'(_ADICT[{s!r}] if {s!r} in _ADICT else {C.PY_FREE_NAME}{s})'
 
     class Not:
+        __slots__ = ('subject', 'ops')
+
         def __init__(self, subject, ops):
             self.subject = subject
             self.ops = ops
@@ -300,6 +480,8 @@ class Node:
             return tr.emit_unary_op(self)
 
     class Number:
+        __slots__ = ('value',)
+
         def __init__(self, value):
             self.value = value
 
@@ -307,6 +489,8 @@ class Node:
             return repr(self.value)
 
     class Or:
+        __slots__ = ('subject', 'pairs')
+
         def __init__(self, subject, pairs):
             self.subject = subject
             self.pairs = pairs
@@ -315,6 +499,8 @@ class Node:
             return tr.emit_left_binary_op(self)
 
     class Param:
+        __slots__ = ('name', 'star', 'expr')
+
         def __init__(self, name, star, expr):
             self.name = name
             self.star = star
@@ -331,6 +517,8 @@ class Node:
             return n
 
     class PipeList:
+        __slots__ = ('subject', 'pipes')
+
         def __init__(self, subject, pipes):
             self.subject = subject
             self.pipes = pipes
@@ -359,6 +547,8 @@ class Node:
             return code
 
     class Power:
+        __slots__ = ('subject', 'pairs')
+
         def __init__(self, subject, pairs):
             self.subject = subject
             self.pairs = pairs
@@ -367,6 +557,8 @@ class Node:
             return tr.emit_right_binary_op(self)
 
     class Product:
+        __slots__ = ('subject', 'pairs')
+
         def __init__(self, subject, pairs):
             self.subject = subject
             self.pairs = pairs
@@ -375,6 +567,8 @@ class Node:
             return tr.emit_left_binary_op(self)
 
     class Sum:
+        __slots__ = ('subject', 'pairs')
+
         def __init__(self, subject, pairs):
             self.subject = subject
             self.pairs = pairs
@@ -383,6 +577,8 @@ class Node:
             return tr.emit_left_binary_op(self)
 
     class Unary:
+        __slots__ = ('subject', 'ops')
+
         def __init__(self, subject, ops):
             self.subject = subject
             self.ops = ops
@@ -391,6 +587,8 @@ class Node:
             return tr.emit_unary_op(self)
 
     class String:
+        __slots__ = ('value',)
+
         def __init__(self, value):
             self.value = value
 
@@ -400,20 +598,28 @@ class Node:
     ##
 
     class Template:
+        __slots__ = ('children', 'parse_state')
+
         def __init__(self):
             self.children = []
+            self.parse_state = None
 
         def emit(self, tr: 'Translator'):
             return [tr.emit(c) for c in self.children]
 
     class Location:
-        def __init__(self, loc):
-            self.loc = loc
+        __slots__ = ('path_index', 'line_num')
+
+        def __init__(self, path_index, line_num):
+            self.path_index = path_index
+            self.line_num = line_num
 
         def emit(self, tr: 'Translator'):
             return self
 
     class Echo:
+        __slots__ = ('start_pos', 'expr', 'format', 'filter')
+
         def __init__(self, start_pos):
             self.start_pos = start_pos
             self.expr = None
@@ -450,6 +656,11 @@ class Node:
             tp.add_child(self)
 
         def emit(self, tr: 'Translator'):
+            folded = tr.fold_echo(self) if tr.cc.options.optimize else None
+            if folded and not folded[1]:
+                # written together with the adjacent text
+                return Node.Text(folded[0])
+
             code = tr.emit(self.expr)
 
             if self.format:
@@ -460,9 +671,17 @@ class Node:
                 fn = tr.emit(Node.Name(self.filter))
                 code = f'{fn}({code})'
 
+            if folded:
+                # functions can still be overridden by template arguments
+                text, names = folded
+                cond = ' or '.join(f'{s!r} in _ADICT' for s in names)
+                code = f'{code} if {cond} else {text!r}'
+
             return tr.emit_echo(code)
 
     class Text:
+        __slots__ = ('text',)
+
         def __init__(self, text):
             self.text = text
 
@@ -470,6 +689,8 @@ class Node:
             return self
 
     class Command:
+        __slots__ = ('cmd', 'start_pos')
+
         def __init__(self, cmd, start_pos):
             self.cmd = cmd
             self.start_pos = start_pos
@@ -487,6 +708,8 @@ class Node:
             raise ValueError()
 
     class BlockCommand(Command):
+        __slots__ = ('blocks', 'children', 'has_else')
+
         def __init__(self, cmd, start_pos):
             super().__init__(cmd, start_pos)
             self.blocks = []
@@ -498,6 +721,8 @@ class Node:
             tp.end_command(self, is_inline)
 
     class DefineFunction(BlockCommand):
+        __slots__ = ('name', 'params', 'expr', 'from_engine')
+
         def __init__(self, cmd, start_pos):
             super().__init__(cmd, start_pos)
             self.name = None
@@ -555,6 +780,7 @@ class Node:
                     f'{nul} = object()',
                     f'def {fun}():',
                     C.PY_BEGIN,
+                    tr.emit_bind_append(),
                     [tr.emit(c) for c in self.blocks[0]],
                     f'return {nul}',
                     C.PY_END,
@@ -581,6 +807,8 @@ class Node:
             return code
 
     class CallFunctionAsCommand(BlockCommand):
+        __slots__ = ('args', 'static_emit_name', 'block_required')
+
         def __init__(self, cmd, start_pos):
             super().__init__(cmd, start_pos)
             self.args = None
@@ -625,9 +853,9 @@ class Node:
                 buf = tr.var()
                 args = _comma([buf] + [tr.emit(a) for a in self.args])
                 return [
-                    '_ENV.pushbuf()',
+                    tr.emit_pushbuf(),
                     [tr.emit(c) for c in self.blocks[0]],
-                    f'{buf} = _ENV.popbuf()',
+                    tr.emit_popbuf(buf),
                     tr.emit_echo(f'{fn}({args})')
                 ]
             else:
@@ -637,6 +865,8 @@ class Node:
     ##
 
     class CommandBreakContinue(Command):
+        __slots__ = ()
+
         def parse(self, tp, is_inline):
             start_pos = tp.buf.pos
             tp.expect_end_of_command(is_inline)
@@ -648,6 +878,8 @@ class Node:
             return self.cmd
 
     class CommandCode(Command):
+        __slots__ = ('lines',)
+
         def __init__(self, cmd, start_pos):
             super().__init__(cmd, start_pos)
             self.lines = []
@@ -690,6 +922,8 @@ class Node:
             ]
 
     class CommandDo(Command):
+        __slots__ = ('exprs',)
+
         def __init__(self, cmd, start_pos):
             super().__init__(cmd, start_pos)
             self.exprs = []
@@ -702,7 +936,28 @@ class Node:
         def emit(self, tr: 'Translator'):
             return tr.emit_try(f'{_comma(tr.emit(a) for a in self.exprs)}')
 
+    class CommandEmbed(Command):
+        __slots__ = ('path',)
+
+        def __init__(self, cmd, start_pos):
+            super().__init__(cmd, start_pos)
+            self.path = None
+
+        def parse(self, tp, is_inline):
+            loc = tp.buf.loc()
+            tail = _unquote(tp.command_tail(is_inline))
+            # only resolved here, the content is read when rendering
+            self.path = tp.cc.resolve(loc.path, tail, loc)
+            tp.add_child(self)
+
+        def emit(self, tr: 'Translator'):
+            if callable(tr.cc.options.loader):
+                return tr.emit_try(f'_ENV.echo(_ENGINE.embed({self.path!r}, _LOADER))')
+            return tr.emit_try(f'_ENV.echo(_ENGINE.embed({self.path!r}))')
+
     class CommandFor(BlockCommand):
+        __slots__ = ('subject', 'names', 'extras')
+
         def __init__(self, cmd, start_pos):
             super().__init__(cmd, start_pos)
             self.subject = None
@@ -745,7 +1000,11 @@ class Node:
             tp.expect_end_of_command(is_inline)
 
         def emit(self, tr: 'Translator'):
-            it = tr.var()
+            # sibling loops share temporaries, nested ones are named by their depth
+            depth = str(tr.depth)
+            tr.depth += 1
+
+            it = C.PY_LOOP_ITER_VAR + depth
             expr = f'_ENV.iter({tr.emit(self.subject)}, {len(self.names)})'
             code = tr.emit_assign(it, expr, fallback='""')
 
@@ -759,7 +1018,7 @@ class Node:
                     f'{v} = 0',
                 ))
 
-            cnt = tr.var()
+            cnt = C.PY_LOOP_COUNT_VAR + depth
             v = self.extras.get('index')
             if v:
                 tr.locals.add(v)
@@ -782,9 +1041,12 @@ class Node:
                     C.PY_END
                 ])
 
+            tr.depth -= 1
             return code
 
     class CommandIf(BlockCommand):
+        __slots__ = ('conds',)
+
         def __init__(self, cmd, start_pos):
             super().__init__(cmd, start_pos)
             self.conds = []
@@ -821,45 +1083,62 @@ class Node:
 
             is compiled to
 
-                done = False
-                if not done:
-                    x = A
-                    if x:
-                        done = True
-                        aaa
-                if not done:
-                    x = B
-                    if x:
-                        done = True
-                        bbb
-                if not done:
-                    x = True
-                    if x:
-                        done = True
-                        ccc
+                if A:
+                    aaa
+                elif B:
+                    bbb
+                else:
+                    ccc
+
+            Conditions are translated before their blocks, which can assign to the same names.
+
+            With an error handler, a failed condition is reported and counts as false,
+            see `Translator.emit_cond`. Conditions are evaluated in turn, and the number
+            of the chosen branch is kept in a variable:
 
+                br = 0
+                try:
+                    if A:
+                        br = 1
+                except Exception as exc:
+                    _ENV.error(exc, loc)
+                if br == 1:
+                    aaa
+                if br == 0:
+                    try:
+                        if B:
+                            br = 2
+                    except Exception as exc:
+                        _ENV.error(exc, loc)
+                if br == 2:
+                    bbb
+                if br == 0:
+                    ccc
 
             """
 
-            done = tr.var()
-            code = [f'{done} = False']
-            for cond, block in zip(self.conds, self.blocks):
-                cnd = tr.var()
+            code = []
+            last = len(self.conds) - 1
+            for n, (cond, block) in enumerate(zip(self.conds, self.blocks)):
+                if n == last and self.has_else:
+                    head = tr.emit_cond(n, None)
+                else:
+                    head = tr.emit_cond(n, tr.emit(cond))
+                tr.depth += 1
                 code.extend([
-                    f'if not {done}:',
-                    C.PY_BEGIN,
-                    tr.emit_assign(cnd, tr.emit(cond)),
-                    f'if {cnd}:',
+                    head,
                     C.PY_BEGIN,
-                    f'{done} = True',
+                    'pass',
                     [tr.emit(c) for c in block],
                     C.PY_END,
-                    C.PY_END,
                 ])
+                tr.depth -= 1
 
             return code
 
     class CommandImport(Command):
+        __slots__ = ('names',)
+
         def __init__(self, cmd, start_pos):
             super().__init__(cmd, start_pos)
             self.names = []
@@ -874,14 +1153,34 @@ class Node:
             return tr.emit_try('import ' + '.'.join(self.names))
 
     class CommandInclude(Command):
+        __slots__ = ('path',)
+
+        def __init__(self, cmd, start_pos):
+            super().__init__(cmd, start_pos)
+            self.path = None
+
         def parse(self, tp, is_inline):
             loc = tp.buf.loc()
             tail = _unquote(tp.command_tail(is_inline))
-            text, path = tp.cc.load(loc.path, tail, loc)
-            tp.buf.paste(text, path, tp.buf.pos)
-            tp.reset()
+
+            if tp.cc.options.include_mode == 'call':
+                # compiled separately and called at runtime, see Compiler.link, only the path is needed here
+                self.path = tp.cc.find(loc.path, tail, loc)
+                tp.add_child(self)
+                return
+
+            text, path, offsets = tp.cc.include(loc.path, tail, loc)
+            tp.buf.paste(text, path, tp.buf.pos, offsets)
+            # options are unchanged, only cached tokens past this point are stale
+            tp.lex.clear()
+
+        def emit(self, tr: 'Translator'):
+            tr.includes[self.path] = True
+            return tr.emit_try(f'_ENV.echo(_ENGINE.call(_INCLUDE({self.path!r}), _ENV.ARGS, _ERRORHANDLER))')
 
     class CommandLet(BlockCommand):
+        __slots__ = ('names', 'exprs')
+
         def __init__(self, cmd, start_pos):
             super().__init__(cmd, start_pos)
             self.names = []
@@ -910,15 +1209,17 @@ class Node:
                 )
             else:
                 code = [
-                    f'_ENV.pushbuf()',
+                    tr.emit_pushbuf(),
                     [tr.emit(c) for c in self.blocks[0]],
-                    f'{_comma(self.names)} = _ENV.popbuf()',
+                    tr.emit_popbuf(_comma(self.names)),
                 ]
 
             tr.locals.update(self.names)
             return code
 
     class CommandOption(Command):
+        __slots__ = ()
+
         def parse(self, tp, is_inline):
             name = tp.expr.expect_name().ident
             tok = tp.lex.token(ignore_nl=is_inline)
@@ -933,6 +1234,8 @@ class Node:
             tp.reset()
 
     class CommandPrint(Command):
+        __slots__ = ('exprs',)
+
         def __init__(self, cmd, start_pos):
             super().__init__(cmd, start_pos)
             self.exprs = []
@@ -951,12 +1254,16 @@ class Node:
                 tp.add_raw_text('\n')
 
     class CommandComment(Command):
+        __slots__ = ()
+
         def parse(self, tp, is_inline):
             label = tp.command_label(is_inline)
             tp.expect_end_of_command(is_inline)
             text = tp.quoted_content(label, is_inline)
 
     class CommandQuote(Command):
+        __slots__ = ()
+
         def parse(self, tp, is_inline):
             label = tp.command_label(is_inline)
             tp.expect_end_of_command(is_inline)
@@ -964,6 +1271,8 @@ class Node:
             tp.add_raw_text(text)
 
     class CommandReturn(Command):
+        __slots__ = ('expr',)
+
         def __init__(self, cmd, start_pos):
             super().__init__(cmd, start_pos)
             self.expr = None
@@ -980,6 +1289,8 @@ class Node:
             return code
 
     class CommandWith(BlockCommand):
+        __slots__ = ('subject', 'alias', 'inverted')
+
         def __init__(self, cmd, start_pos):
             super().__init__(cmd, start_pos)
             self.subject = None
@@ -1046,6 +1357,7 @@ class Node:
         'continue': CommandBreakContinue,
         'do': CommandDo,
         'each': CommandFor,
+        'embed': CommandEmbed,
         'for': CommandFor,
         'if': CommandIf,
         'import': CommandImport,
@@ -1072,49 +1384,136 @@ class CompileError(ValueError):
         super().__init__(message)
         self.message = message
 
+    def __reduce__(self):
+        # errors are passed between processes
+        return _restore_compile_error, (self.message, self.path, self.line)
+
+
+def _restore_compile_error(message, path, line):
+    exc = CompileError.__new__(CompileError)
+    ValueError.__init__(exc, message)
+    exc.message = message
+    exc.path = path
+    exc.line = line
+    return exc
+
 
 class Buffer:
+    """Template source buffer.
+
+    Pasted texts are kept as pieces `[start, text, lo, hi]`, views of `text[lo:hi]` at the buffer position `start`,
+    line starts are indexed by segments, each segment is a slice `[lo, hi)` of line offsets shared by all pieces of a pasted text.
+    Pasting splits the piece and the segment at the position and shifts the following ones, which are the unread
+    rests of the including texts, so an `@include` costs proportional to the included text and the nesting depth.
+
+    Text is read from the piece containing a position, scans continue into the following pieces,
+    but single tokens and delimiters don't span the end of an included text.
+    """
+
     def __init__(self):
         self.length = 0
-        self.line_pointers = []
+        self.segments = []
+        self.seg_starts = []
+        self.pieces = []
+        self.piece_starts = []
         self.location_cache = {}
         self.paths = []
+        self.path_indexes = {}
         self.pos = 0
-        self.text = ''
 
-    def paste(self, text, path, pos):
-        try:
-            path_index = self.paths.index(path)
-        except ValueError:
+        # the last piece looked up: buffer range [cur_start, cur_end), (text, delta, local end)
+        self.cur_start = 0
+        self.cur_end = 0
+        self.cur = '', 0, 0
+
+    def paste(self, text, path, pos, line_offsets=None):
+        path_index = self.path_indexes.get(path)
+        if path_index is None:
+            path_index = self.path_indexes[path] = len(self.paths)
             self.paths.append(path)
-            path_index = len(self.paths) - 1
 
         if not text:
-            if not self.line_pointers:
-                self.line_pointers = [[0, path_index, 1]]
+            if not self.segments:
+                self.segments = [[0, [0], 0, 1, path_index]]
+                self.seg_starts = [0]
             return
 
         text_len = len(text)
-        lps = self.line_pointers
 
-        for lp in lps:
-            if lp[0] >= pos:
-                lp[0] += text_len
+        # segments starting at or after pos are moved as a whole,
+        # the one before can contain pointers >= pos and has to be split
 
-        line_num = 1
-        p = 0
-        while p < text_len:
-            lps.append([pos + p, path_index, line_num])
-            p = text.find(C.NL, p)
-            if p < 0:
-                break
-            p += 1
-            line_num += 1
+        segs = self.segments
+        si = bisect.bisect_left(self.seg_starts, pos)
+        tail = segs[si:]
+
+        if si:
+            base, offsets, lo, hi, pi = segs[si - 1]
+            k = bisect.bisect_left(offsets, pos - base, lo, hi)
+            if k < hi:
+                segs[si - 1] = [base, offsets, lo, k, pi]
+                tail.insert(0, [base, offsets, k, hi, pi])
+
+        for seg in tail:
+            seg[0] += text_len
+
+        # line offsets are never modified, so a list can be shared by pastes of the same text
+        seg = [pos, line_offsets or _line_offsets(text), 0, 0, path_index]
+        seg[3] = len(seg[1])
+
+        segs[si:] = [seg] + tail
+        self.seg_starts[si:] = [s[0] + s[1][s[2]] for s in segs[si:]]
+
+        # the same for pieces, the one containing pos is split into the part before and the rest after the new text
 
-        lps.sort()
-        self.text = self.text[:pos] + text + self.text[pos:]
-        self.length = len(self.text)
+        pieces = self.pieces
+        pi = bisect.bisect_left(self.piece_starts, pos)
+        tail = pieces[pi:]
+
+        if pi:
+            start, ptext, lo, hi = pieces[pi - 1]
+            k = lo + pos - start
+            if k < hi:
+                pieces[pi - 1] = [start, ptext, lo, k]
+                tail.insert(0, [pos, ptext, k, hi])
+
+        for piece in tail:
+            piece[0] += text_len
+
+        pieces[pi:] = [[pos, text, 0, text_len]] + tail
+        self.piece_starts[pi:] = [piece[0] for piece in pieces[pi:]]
+
+        self.length += text_len
         self.location_cache = {}
+        self.cur_start = self.cur_end = 0
+
+    def piece(self, pos):
+        """Return (text, delta, end) of the piece containing pos, the character at pos is `text[pos - delta]`.
+
+        Scans are bounded by `end`, the text of a piece can continue with another one.
+        """
+
+        if self.cur_start <= pos < self.cur_end:
+            return self.cur
+        if not self.pieces:
+            return self.cur
+        i = max(0, bisect.bisect_right(self.piece_starts, pos) - 1)
+        start, text, lo, hi = self.pieces[i]
+        self.cur_start = start
+        self.cur_end = start + hi - lo
+        self.cur = text, start - lo, hi
+        return self.cur
+
+    def search(self, regex, pos):
+        """Return (position, match) of the next regex match at or after pos, or None."""
+
+        while pos < self.length:
+            text, delta, end = self.cur if self.cur_start <= pos < self.cur_end else self.piece(pos)
+            m = regex.search(text, pos - delta, end)
+            if m:
+                return m.start() + delta, m
+            pos = end + delta
+        return None
 
     def loc(self, pos=None):
         if pos is None:
@@ -1123,32 +1522,46 @@ class Buffer:
         if pos in self.location_cache:
             return self.location_cache[pos]
 
-        lptr = self.line_pointers[self.lptr_index(pos)]
-        line_start_pos, path_index, line_num = lptr
+        si, i = self.lptr_index(pos)
+        base, offsets, _, _, path_index = self.segments[si]
+        line_start_pos = base + offsets[i]
         loc = Location(
             line_start_pos=line_start_pos,
             path_index=path_index,
             path=self.paths[path_index],
-            line_num=line_num,
+            line_num=i + 1,
             column=pos - line_start_pos,
             pos=pos)
 
         self.location_cache[pos] = loc
         return loc
 
+    def line_ref(self, pos):
+        """Return (path index, line number) for a position."""
+
+        si, i = self.lptr_index(pos)
+        return self.segments[si][4], i + 1
+
     def lptr_index(self, pos):
-        lps = self.line_pointers
-        le = 0
-        ri = len(lps) - 1
-        while le <= ri:
-            m = (le + ri) >> 1
-            if lps[m][0] < pos:
-                le = m + 1
-            elif lps[m][0] > pos:
-                ri = m - 1
-            else:
-                return m
-        return le - 1
+        """Return (segment index, offset index) of the last line start <= pos."""
+
+        si = max(0, bisect.bisect_right(self.seg_starts, pos) - 1)
+        base, offsets, lo, hi, _ = self.segments[si]
+        return si, max(lo, bisect.bisect_right(offsets, pos - base, lo, hi) - 1)
+
+    def line_start(self, pos):
+        si, i = self.lptr_index(pos)
+        seg = self.segments[si]
+        return seg[0] + seg[1][i]
+
+    def next_line_start(self, pos):
+        si, i = self.lptr_index(pos)
+        base, offsets, _, hi, _ = self.segments[si]
+        if i + 1 < hi:
+            return base + offsets[i + 1]
+        if si + 1 < len(self.segments):
+            return self.seg_starts[si + 1]
+        return -1
 
     def eof(self):
         return self.pos >= self.length
@@ -1156,13 +1569,12 @@ class Buffer:
     def at_line_start(self, pos=None):
         if pos is None:
             pos = self.pos
-        lptr = self.line_pointers[self.lptr_index(pos)]
-        p = lptr[0]
-        while p < self.pos:
-            if self.text[p] not in C.WS:
-                return False
-            p += 1
-        return True
+        p = self.line_start(pos)
+        text, delta, _ = self.cur if self.cur_start <= pos < self.cur_end else self.piece(pos)
+        if p >= self.cur_start:
+            return C.RE_WS.match(text, p - delta, pos - delta).end() == pos - delta
+        # the line starts in a previous piece
+        return not self.slice(p, pos).strip(C.WS)
 
     def at_space(self):
         return self.char() in C.WSNL
@@ -1170,13 +1582,19 @@ class Buffer:
     def at_string(self, s):
         if not s:
             return False
-        return self.text.startswith(s, self.pos)
+        text, delta, end = self.cur if self.cur_start <= self.pos < self.cur_end else self.piece(self.pos)
+        return text.startswith(s, self.pos - delta, end)
 
-    def char(self):
-        try:
-            return self.text[self.pos]
-        except IndexError:
+    def char(self, pos=None):
+        if pos is None:
+            pos = self.pos
+        if self.cur_start <= pos < self.cur_end:
+            text, delta, _ = self.cur
+            return text[pos - delta]
+        if pos < 0 or pos >= self.length:
             return ''
+        text, delta, _ = self.cur if self.cur_start <= pos < self.cur_end else self.piece(pos)
+        return text[pos - delta]
 
     def next(self, n=1):
         self.pos += n
@@ -1185,134 +1603,151 @@ class Buffer:
         self.pos = p
 
     def line_tail(self):
-        li = self.lptr_index(self.pos)
-        if li < len(self.line_pointers) - 1:
-            p = self.line_pointers[li + 1][0] - 1
-            s = self.text[self.pos:p]
+        p = self.next_line_start(self.pos)
+        if p >= 0:
+            p -= 1
+            s = self.slice(self.pos, p)
             self.pos = p + 1
         else:
-            s = self.text[self.pos:]
+            s = self.slice(self.pos, self.length)
             self.pos = self.length
         return s.strip()
 
     def find(self, s, pos):
-        return self.text.find(s, pos)
+        while pos < self.length:
+            text, delta, end = self.cur if self.cur_start <= pos < self.cur_end else self.piece(pos)
+            p = text.find(s, pos - delta, end)
+            if p >= 0:
+                return p + delta
+            pos = end + delta
+        return -1
 
     def skip_ws(self, with_nl: bool):
-        p = self.pos
-        chars = C.WSNL if with_nl else C.WS
-        while p < self.length:
-            if self.text[p] not in chars:
-                break
-            p += 1
+        regex = C.RE_WSNL if with_nl else C.RE_WS
+        text, delta, end = self.cur if self.cur_start <= self.pos < self.cur_end else self.piece(self.pos)
+        p = regex.match(text, self.pos - delta, end).end() + delta
+        # whitespace can continue in the next piece
+        while p == end + delta and p < self.length:
+            text, delta, end = self.cur if self.cur_start <= p < self.cur_end else self.piece(p)
+            p = regex.match(text, p - delta, end).end() + delta
         if p == self.pos:
             return False
         self.pos = p
         return True
 
-    def strpbrk(self, chars):
-        p = self.pos
-        while p < self.length:
-            if self.text[p] in chars:
-                break
-            p += 1
-        return p
+    def match(self, regex):
+        text, delta, end = self.cur if self.cur_start <= self.pos < self.cur_end else self.piece(self.pos)
+        m = regex.match(text, self.pos - delta, end)
+        self.pos = m.end() + delta
+        return m.group()
 
     def slice(self, a, b):
-        return self.text[a:b]
+        b = min(b, self.length)
+        text, delta, end = self.cur if self.cur_start <= a < self.cur_end else self.piece(a)
+        if b - delta <= end:
+            return text[a - delta:b - delta]
+        parts = []
+        while a < b:
+            text, delta, end = self.cur if self.cur_start <= a < self.cur_end else self.piece(a)
+            parts.append(text[a - delta:min(b - delta, end)])
+            a = end + delta
+        return ''.join(parts)
 
 
 class Lexer:
+    """Expression lexer.
+
+    Tokens are tuples indexed by `C.TOK_*`. Common tokens are matched with `C.RE_TOKEN`,
+    escaped strings and unusual numbers fall back to the character scanners below.
+    Tokens are cached by position for backtracking, the cache is cleared for each command.
+    """
+
     def __init__(self, buf: Buffer):
         self.buf = buf
         self.token_cache = {}
 
     def token(self, ignore_nl: bool):
         pos = self.buf.pos
-        if pos not in self.token_cache:
-            self.token_cache[pos] = self.token2(ignore_nl)
-        self.buf.to(self.token_cache[pos][C.TOK_NEXTPOS])
-        return self.token_cache[pos]
+        tok = self.token_cache.get(pos)
+        if tok is None:
+            tok = self.token_cache[pos] = self.token2(ignore_nl)
+        self.buf.pos = tok[C.TOK_NEXTPOS]
+        return tok
 
     def back(self, tok):
         self.buf.to(tok[C.TOK_POS])
 
+    def clear(self):
+        self.token_cache = {}
+
     def token2(self, ignore_nl):
+        buf = self.buf
+        pos = buf.pos
+
+        # q is the position in the text of the piece, buffer positions are shifted by delta
+        text, delta, end = buf.cur if buf.cur_start <= pos < buf.cur_end else buf.piece(pos)
+        q = (C.RE_WSNL if ignore_nl else C.RE_WS).match(text, pos - delta, end).end()
+        if q == end and q + delta < buf.length:
+            buf.skip_ws(ignore_nl)
+            text, delta, end = buf.piece(buf.pos)
+            q = buf.pos - delta
+
+        space_before = q + delta > pos
         value = None
-        pos = self.buf.pos
 
-        space_before = self.buf.skip_ws(with_nl=ignore_nl)
+        m = C.RE_TOKEN.match(text, q, end)
+        kind = m.lastgroup if m else None
 
-        if self.buf.eof():
+        if q + delta >= buf.length:
             typ = T.EOF
-        elif self.buf.char() == C.NL:
+        elif kind == 'name':
+            value = m.group()
+            q = m.end()
+            typ = T.NAME
+            if value in C.KEYWORDS:
+                typ, value = value, None
+                if typ == 'not':
+                    m = C.RE_IN.match(text, q, end)
+                    if m:
+                        typ = 'not in'
+                        q = m.end()
+            elif value in C.CONST:
+                typ, value = T.CONST, C.CONST[value]
+        elif kind == 'punct':
+            typ = m.group()
+            q = m.end()
+        elif kind == 'int':
+            typ, value = T.NUMBER, int(m.group().replace('_', ''), 10)
+            q = m.end()
+        elif kind == 'string':
+            typ, value = T.STRING, m.group()[1:-1]
+            q = m.end()
+        elif kind == 'newline':
             typ = T.NEWLINE
         else:
-            tv = self.token3()
-            if tv:
-                typ = tv[0]
-                value = tv[1]
+            buf.pos = q + delta
+            ch = buf.char()
+            if ch in C.QUOTES:
+                typ, value = T.STRING, self.string()
+            elif ch in C.DIGIT_DEC:
+                typ, value = T.NUMBER, self.number()
             else:
-                self.buf.to(pos)
                 typ = T.INVALID
+            p = buf.pos = buf.pos if typ != T.INVALID else pos
+            return typ, pos, p, space_before, p >= buf.length or buf.char(p) in C.WSNL, value
 
-        return [
+        p = buf.pos = q + delta
+        return (
             typ,
             pos,
-            self.buf.pos,
+            p,
             space_before,
-            self.buf.at_space(),
+            p >= buf.length or (text[q] if q < end else buf.char(p)) in C.WSNL,
             value
-        ]
-
-    def token3(self):
-        ch = self.buf.char()
-
-        if ch in C.IDENTIFIER_START:
-            s = self.identifier()
-            if s in C.KEYWORDS:
-                if s == 'not':
-                    pos2 = self.buf.pos
-                    self.buf.skip_ws(with_nl=False)
-                    s2 = self.identifier()
-                    if s2 == 'in':
-                        return 'not in', None
-                    self.buf.to(pos2)
-                return s, None
-            if s in C.CONST:
-                return T.CONST, C.CONST[s]
-            return T.NAME, s
-
-        if ch in C.QUOTES:
-            return T.STRING, self.string()
-
-        if ch in C.DIGIT_DEC:
-            return T.NUMBER, self.number()
-
-        if ch in C.PUNCT:
-            return self.punctuation(), None
+        )
 
     def identifier(self):
-        chars = ''
-
-        while not self.buf.eof():
-            ch = self.buf.char()
-            if ch not in C.IDENTIFIER_CONTINUE:
-                break
-            chars += ch
-            self.buf.next()
-
-        return chars
-
-    def punctuation(self):
-        c1 = self.buf.char()
-        if c1 in C.PUNCT:
-            self.buf.next()
-            c2 = self.buf.char()
-            if c1 + c2 in C.PUNCT:
-                self.buf.next()
-                return c1 + c2
-            return c1
+        return self.buf.match(C.RE_IDENTIFIER)
 
     def string(self):
         quot = self.buf.char()
@@ -1323,9 +1758,14 @@ class Lexer:
         return chars
 
     def string_to(self, end_sym, start_pos):
-        chars = ''
+        chars = []
+        plain = _plain_chars_regex(end_sym)
 
         while True:
+            s = self.buf.match(plain)
+            if s:
+                chars.append(s)
+
             if self.buf.at_string(end_sym):
                 break
 
@@ -1334,12 +1774,12 @@ class Lexer:
                 raise CompileError('unterminated string', self.buf.loc(self.buf.pos), self.buf.loc(start_pos))
             if ch == '\\':
                 self.buf.next()
-                chars += self.string_escape()
+                chars.append(self.string_escape())
             else:
                 self.buf.next()
-                chars += ch
+                chars.append(ch)
 
-        return chars
+        return ''.join(chars)
 
     def string_escape(self):
         ch = self.buf.char()
@@ -1474,6 +1914,15 @@ class Lexer:
 
 
 class ExpressionParser:
+    BINARY_NODES = {
+        C.OR_LEVEL: Node.Or,
+        C.AND_LEVEL: Node.And,
+        C.COMPARISON_LEVEL: Node.Comparison,
+        C.SUM_LEVEL: Node.Sum,
+        C.PRODUCT_LEVEL: Node.Product,
+        C.POWER_LEVEL: Node.Power,
+    }
+
     def __init__(self, lex: Lexer):
         self.lex = lex
         self.paren_stack = []
@@ -1513,25 +1962,55 @@ class ExpressionParser:
         return yes
 
     def orexpr(self):
-        return self.binary_op(Node.Or, {'or'}, self.andexpr)
+        return self.binary(C.OR_LEVEL)
 
-    def andexpr(self):
-        return self.binary_op(Node.And, {'and'}, self.notexpr)
+    def binary(self, level):
+        """Parse operators of `level` and above by precedence climbing.
 
-    def notexpr(self):
-        return self.unary_op(Node.Not, {'not'}, self.comparison)
+        Each run of same-level operators is collected into one n-ary node,
+        like the chain of per-level functions the grammar is written as.
+        """
 
-    def comparison(self):
-        return self.binary_op(Node.Comparison, C.COMPARE_OPS, self.sum)
+        tok = self.token()
+        self.lex.back(tok)
+        if level <= C.NOT_LEVEL and tok[C.TOK_TYPE] == 'not':
+            node = self.unary_op(Node.Not, {'not'}, self.comparison)
+        elif tok[C.TOK_TYPE] in C.ADD_OPS:
+            node = self.unary()
+        else:
+            node = self.primary()
+        if not node:
+            return
+
+        while True:
+            tok = self.token()
+            op = tok[C.TOK_TYPE]
+            op_level = C.BINARY_LEVELS.get(op)
+            if not op_level or op_level < level or tok[C.TOK_SPACE_BEFORE] != tok[C.TOK_SPACE_AFTER]:
+                self.lex.back(tok)
+                return node
+
+            pairs = [[op, self.binary_operand(op_level)]]
 
-    def sum(self):
-        return self.binary_op(Node.Sum, C.ADD_OPS, self.product)
+            while True:
+                tok = self.token()
+                op = tok[C.TOK_TYPE]
+                if C.BINARY_LEVELS.get(op) == op_level and tok[C.TOK_SPACE_BEFORE] == tok[C.TOK_SPACE_AFTER]:
+                    pairs.append([op, self.binary_operand(op_level)])
+                else:
+                    self.lex.back(tok)
+                    break
+
+            node = self.BINARY_NODES[op_level](node, pairs)
 
-    def product(self):
-        return self.binary_op(Node.Product, C.MUL_OPS, self.power)
+    def binary_operand(self, level):
+        node = self.binary(level + 1)
+        if node:
+            return node
+        raise CompileError(f'{C.BINARY_OPERANDS[level]!r} expected', self.lex.buf.loc())
 
-    def power(self):
-        return self.binary_op(Node.Power, C.POWER_OP, self.unary)
+    def comparison(self):
+        return self.binary(C.COMPARISON_LEVEL)
 
     def unary(self):
         return self.unary_op(Node.Unary, C.ADD_OPS, self.primary)
@@ -1760,26 +2239,6 @@ class ExpressionParser:
 
         return typ(subject, ops)
 
-    def binary_op(self, typ, operators, arg_fn):
-        subject = arg_fn()
-        if not subject:
-            return
-
-        pairs = []
-
-        while True:
-            tok = self.token()
-            if tok[C.TOK_TYPE] in operators and tok[C.TOK_SPACE_BEFORE] == tok[C.TOK_SPACE_AFTER]:
-                pairs.append([tok[C.TOK_TYPE], self.expect(arg_fn)])
-            else:
-                self.lex.back(tok)
-                break
-
-        if not pairs:
-            return subject
-
-        return typ(subject, pairs)
-
     def expect(self, fn):
         node = fn()
         if node:
@@ -1817,6 +2276,70 @@ class ExpressionParser:
         return self.lex.token(bool(self.paren_stack))
 
 
+class SyntaxProfile:
+    """Escapes and the delimiter scanner for a set of syntax options.
+
+    Profiles are computed once per distinct option set and shared between compiles.
+    """
+
+    __slots__ = ('escapes', 'scanner', 'include_scanner')
+
+    KEYS = ('escapes', 'inline_open_symbol', 'inline_close_symbol', 'echo_open_symbol', 'comment_symbol', 'command_symbol')
+
+    _cache = {}
+
+    def __init__(self, escapes, inline_open_symbol, inline_close_symbol, echo_open_symbol, comment_symbol, command_symbol):
+        esc = escapes.split()
+        self.escapes = dict(zip(esc[::2], esc[1::2]))
+
+        # a regex matching the next delimiter, escapes come first, then longest symbols
+
+        by_len = [
+            ['inline', inline_open_symbol],
+            ['echo', echo_open_symbol],
+            ['comment', comment_symbol],
+            ['command', command_symbol],
+        ]
+        by_len.sort(key=lambda h: len(h[1]), reverse=True)
+
+        alts = []
+        if esc:
+            alts.append('(?P<escape>' + '|'.join(re.escape(e) for e in esc[::2]) + ')')
+        for name, sym in by_len:
+            if sym:
+                alts.append(f'(?P<{name}>{re.escape(sym)})')
+
+        # (?!) never matches
+        self.scanner = re.compile('|'.join(alts) or '(?!)')
+
+        # a rough regex for include paths, used to prefetch them before parsing
+        # quoted and commented regions are matched as a whole by the 'skip' group, so that includes in them are ignored
+
+        skip = []
+        alts = []
+        if comment_symbol:
+            skip.append(rf'^[ \t]*{re.escape(comment_symbol)}[^\n]*')
+        if command_symbol:
+            cmd = re.escape(command_symbol)
+            skip.append(rf'^[ \t]*{cmd}(?:quote|comment)\b[ \t]*(?P<label>\w*)[ \t]*$.*?^[ \t]*{cmd}{C.END_SYMBOL}\b[ \t]*(?P=label)[ \t]*$')
+            alts.append(rf'^[ \t]*{cmd}include\b([^\n]*)')
+        if inline_open_symbol and inline_close_symbol:
+            op, cl = re.escape(inline_open_symbol), re.escape(inline_close_symbol)
+            skip.append(rf'{op}(?:quote|comment)\b\s*(?P<inline_label>\w*)\s*{cl}.*?{op}{C.END_SYMBOL}\b\s*(?P=inline_label)\s*{cl}')
+            alts.append(rf'{op}include\b([^\n]*?){cl}')
+        if skip:
+            alts.insert(0, '(?P<skip>' + '|'.join(skip) + ')')
+        self.include_scanner = re.compile('|'.join(alts) or '(?!)', re.M | re.S)
+
+    @classmethod
+    def get(cls, options):
+        key = tuple(getattr(options, k) for k in cls.KEYS)
+        p = cls._cache.get(key)
+        if p is None:
+            p = cls._cache[key] = cls(*key)
+        return p
+
+
 class TemplateParser:
     def __init__(self, compiler: 'Compiler'):
         self.cc = compiler
@@ -1824,58 +2347,144 @@ class TemplateParser:
         self.lex = Lexer(self.buf)
         self.expr = ExpressionParser(self.lex)
         self.stack = []
-        self.special_chars = ''
-        self.elements = []
-        self.escape_dct = {}
-
-        self.static_function_bindings = {}
-        for a in dir(self.cc.engine):
-            if '_' in a:
-                cmd, _, name = a.partition('_')
-                if cmd in C.DEF_COMMANDS:
-                    self.static_function_bindings[name] = [cmd, a]
+        self.syntax = None
+        self.elements = {
+            'escape': self.escape_element,
+            'inline': self.inline_element,
+            'echo': self.echo_element,
+            'comment': self.comment_element,
+            'command': self.command_element,
+        }
+
+        # @def adds bindings, so each parser gets a copy
+        self.static_function_bindings = dict(_engine_bindings(self.cc.engine))
+
+        # top-level [pos, number of children, state] where parsing can be resumed, see `reparse`
+        self.checkpoints = None
+        self.state = None
+
+        # when a list, errors are collected here and parsing continues on the next line
+        self.errors = None
+        self.last_command = None
 
         self.reset()
 
     def reset(self):
         self.buf.location_cache = {}
         self.lex.token_cache = {}
+        self.syntax = SyntaxProfile.get(self.cc.options)
 
-        self.escape_dct = dict(zip(
-            self.cc.options.escapes.split()[::2],
-            self.cc.options.escapes.split()[1::2]
-        ))
-
-        self.special_chars = ''.join(set(
-            self.cc.options.comment_symbol
-            + self.cc.options.command_symbol
-            + self.cc.options.inline_open_symbol
-            + self.cc.options.inline_close_symbol
-            + self.cc.options.echo_open_symbol
-            + self.cc.options.echo_close_symbol
-            + ''.join(self.cc.options.escapes.split())
-        ))
-
-        # make sure longest parsers come first
-        by_len = [
-            [self.cc.options.inline_open_symbol, self.inline_element],
-            [self.cc.options.echo_open_symbol, self.echo_element],
-            [self.cc.options.comment_symbol, self.comment_element],
-            [self.cc.options.command_symbol, self.command_element],
-        ]
-        by_len.sort(key=lambda h: len(h[0]), reverse=True)
+    def parse(self):
+        self.stack = [Node.Template()]
+        self.add_child(Node.Location(*self.buf.line_ref(0)))
 
-        self.elements = [self.text_element, self.escape_element] + [h[1] for h in by_len]
+        if self.checkpoints is not None:
+            self.add_checkpoint()
+
+        while not self.buf.eof():
+            if self.errors is None:
+                self.parse_element()
+            else:
+                self.parse_element_or_recover()
+            if self.checkpoints is not None:
+                self.add_checkpoint()
+
+        if self.errors is None:
+            return self.end_parse()
+
+        try:
+            return self.end_parse()
+        except CompileError as exc:
+            self.errors.append(exc)
+            return self.stack[0]
+
+    def parse_element_or_recover(self):
+        start_pos = self.buf.pos
+        try:
+            self.parse_element()
+        except CompileError as exc:
+            self.errors.append(exc)
+            self.expr.paren_stack = []
+            self.lex.clear()
+
+            # open a placeholder for a broken block command, so that its '@end' is not reported as well
+            cmd = self.last_command
+            if cmd and cmd[1] >= start_pos and cmd[0] in C.BLOCK_COMMANDS and getattr(self.top(), 'start_pos', None) != cmd[1]:
+                self.begin_command(Node.COMMANDS[cmd[0]](*cmd))
+            p = self.buf.pos
+            if p <= start_pos or self.buf.char(p - 1) != C.NL:
+                p = self.buf.next_line_start(max(p, start_pos))
+            self.buf.to(p if p > start_pos else self.buf.length)
+
+    def reparse(self, tree, offset, removed, inserted):
+        """Parse the buffer, which is the `tree` source with an edit applied."""
+
+        old = tree.parse_state.checkpoints
+        delta = len(inserted) - removed
+        old_end = offset + removed
+        new_end = offset + len(inserted)
+
+        # resume at the last checkpoint strictly before the edit
+
+        i = bisect.bisect_left(old, [offset]) - 1
+        if i < 0:
+            return self.cc.parse(incremental=True)
+
+        pos, num_children, state = old[i]
+        self.cc.options = Data(**state[0])
+        self.static_function_bindings = dict(state[1])
+        self.reset()
 
-    def parse(self):
         self.stack = [Node.Template()]
-        self.add_child(Node.Location(self.buf.loc(0)))
+        self.top().children = tree.children[:num_children]
+        self.checkpoints = old[:i + 1]
+        self.state = state
+        self.buf.to(pos)
 
         while not self.buf.eof():
-            if not any(f() for f in self.elements):
-                self.add_raw_text(self.buf.char())
-                self.buf.next()
+            self.parse_element()
+            cp = self.add_checkpoint()
+            if not cp or cp[0] < new_end:
+                continue
+
+            # back in sync if the old parse had the same state at this point
+
+            k = bisect.bisect_left(old, [cp[0] - delta])
+            if k == len(old) or old[k][0] != cp[0] - delta or old[k][0] < old_end or old[k][2] != cp[2]:
+                continue
+
+            line_delta = inserted.count(C.NL) - tree.parse_state.text.count(C.NL, offset, old_end)
+            suffix = tree.children[old[k][1]:]
+            _shift_nodes(suffix, delta, line_delta, set())
 
+            child_delta = cp[1] - old[k][1]
+            self.top().children.extend(suffix)
+            self.checkpoints.extend([p + delta, n + child_delta, s] for p, n, s in old[k + 1:])
+            self.buf.to(self.buf.length)
+            break
+
+        node = self.end_parse()
+        node.parse_state = ParseState(self.buf.slice(0, self.buf.length), self.buf.paths[0], tree.parse_state.options, self.checkpoints, self.buf)
+        return node
+
+    def add_checkpoint(self):
+        # parsing can be resumed at a top-level line start, unless the last text can be stripped by a command
+        children = self.stack[0].children
+        if len(self.stack) > 1 or isinstance(children[-1], Node.Text):
+            return
+        pos = self.buf.pos
+        if pos > 0 and self.buf.char(pos - 1) != C.NL:
+            return
+
+        opts = vars(self.cc.options)
+        if not self.state or self.state[0] != opts or self.state[1] != self.static_function_bindings:
+            self.state = dict(opts), dict(self.static_function_bindings)
+
+        cp = [pos, len(children), self.state]
+        self.checkpoints.append(cp)
+        return cp
+
+    def end_parse(self):
         if len(self.stack) > 1:
             raise CompileError(
                 f'missing {C.END_SYMBOL!r}',
@@ -1884,15 +2493,31 @@ class TemplateParser:
 
         return self.stack[0]
 
-    def text_element(self):
-        p = self.buf.strpbrk(self.special_chars)
-        if p > self.buf.pos:
-            self.add_text(self.buf.slice(self.buf.pos, p), self.buf.pos)
+    def parse_element(self):
+        # jump to the next delimiter, commands and comments only count at line start
+        start_pos = p = self.buf.pos
+        kind = None
+
+        while True:
+            found = self.buf.search(self.syntax.scanner, p)
+            if not found:
+                p = self.buf.length
+                break
+            p, m = found
+            if m.lastgroup not in _LINE_ELEMENTS or self.buf.at_line_start(p):
+                kind = m.lastgroup
+                break
+            p += 1
+
+        if p > start_pos:
+            self.add_text(self.buf.slice(start_pos, p), start_pos)
             self.buf.to(p)
-            return True
+
+        if kind:
+            self.elements[kind]()
 
     def escape_element(self):
-        for esc, repl in self.escape_dct.items():
+        for esc, repl in self.syntax.escapes.items():
             if self.buf.at_string(esc):
                 self.add_raw_text(repl)
                 self.buf.next(len(esc))
@@ -1951,7 +2576,8 @@ class TemplateParser:
         return True
 
     def parse_echo(self, start_pos):
-        self.add_child(Node.Location(self.buf.loc(start_pos)))
+        self.lex.clear()
+        self.add_child(Node.Location(*self.buf.line_ref(start_pos)))
         Node.Echo(start_pos).parse(self)
         return True
 
@@ -1959,6 +2585,7 @@ class TemplateParser:
         return self.parse_command(start_pos, is_inline=True)
 
     def parse_command(self, start_pos, is_inline):
+        self.lex.clear()
         cmd = self.lex.identifier()
         if not cmd:
             self.add_text(self.buf.slice(start_pos, self.buf.pos), start_pos)
@@ -1967,7 +2594,8 @@ class TemplateParser:
         if not is_inline:
             self.strip_last_indent()
 
-        self.add_child(Node.Location(self.buf.loc(start_pos)))
+        self.add_child(Node.Location(*self.buf.line_ref(start_pos)))
+        self.last_command = cmd, start_pos
 
         # custom command?
         p = self.static_function_bindings.get(cmd)
@@ -2118,36 +2746,98 @@ class TemplateParser:
 
 
 class Translator:
+    class Value:
+        # an echo in the fail-fast variant, written together with the surrounding text
+        __slots__ = ('var', 'value')
+
+        def __init__(self, value):
+            self.var = None
+            self.value = value
+
     def __init__(self, cc: 'Compiler'):
         self.cc = cc
         self.num_vars = 0
         self.locals = {'_', 'ARGS'}
         self.frames = []
+        self.free_names = {}
+        self.folded_names = {}
+        self.fail_fast = False
+        self.depth = 0
+        # paths included in the 'call' mode, see Compiler.link
+        self.includes = {}
 
     def translate(self, node):
+        name = self.cc.options.name
+        fast = ''
+        attrs = []
+
+        if self.cc.options.fail_fast:
+            fast_name = name + C.PY_FAIL_FAST_SUFFIX
+            # the fail-fast variant comes first, so that both variants see the same free names
+            fast = C.NL + self.translate_variant(node, C.PY_TEMPLATE_FAIL_FAST, fast_name, True)
+            attrs.append(f'{name}.fail_fast = {fast_name}')
+
+        py = self.translate_variant(node, C.PY_TEMPLATE, name, False) + fast
+
+        if self.includes:
+            attrs.append(f'{name}.includes = {list(self.includes)!r}')
+        if attrs:
+            py += C.NL + C.NL.join(attrs) + C.NL
+        return py
+
+    def translate_variant(self, node, py_template, name, fail_fast):
+        self.locals = {'_', 'ARGS'}
+        self.frames = []
+        self.fail_fast = fail_fast
+        self.depth = 0
+
         code = []
         indent = 2  # see py_template
         cur_loc = '(0,0)'
-        text_buf = []
 
-        for elem in _flatten(self.emit(node)):
+        # (line relative to the function start, path index, template line) for each marker
+        lines = []
+        first_line = py_template[:py_template.index('$code$')].count(C.NL) + 1
+
+        elems = list(_flatten(self.emit(node)))
+        prologue = list(_flatten(self.emit_free_names()))
+
+        # text and values written with a single append
+        run = []
+        num_values = 0
+
+        for elem in prologue + elems:
             if isinstance(elem, Node.Text):
-                text_buf.append(elem.text or '')
+                run.append(elem.text or '')
                 continue
 
-            if text_buf:
-                s = ''.join(text_buf)
-                if s:
-                    code.append((C.PY_INDENT * indent) + f'_ENV.echo({s!r})')
-                text_buf = []
+            if isinstance(elem, Translator.Value):
+                # values are named by their position in the run
+                elem.var = C.PY_RUN_VAR + str(num_values)
+                code.append((C.PY_INDENT * indent) + f'{elem.var} = {elem.value}')
+                run.append(elem)
+                num_values += 1
+                if num_values == C.PY_MAX_RUN_VALUES:
+                    code.append((C.PY_INDENT * indent) + _append_run(run))
+                    run = []
+                    num_values = 0
+                continue
 
             if isinstance(elem, Node.Location):
-                new_loc = _parens(f'{elem.loc.path_index},{elem.loc.line_num}')
+                new_loc = _parens(f'{elem.path_index},{elem.line_num}')
                 if new_loc != cur_loc:
-                    code.append(C.PY_MARKER + _path_line(elem.loc.path, elem.loc.line_num))
+                    lines.append((first_line + len(code), elem.path_index, elem.line_num))
+                    code.append(C.PY_MARKER + _path_line(self.cc.buf.paths[elem.path_index], elem.line_num))
                     cur_loc = new_loc
                 continue
 
+            if run:
+                s = _append_run(run)
+                if s:
+                    code.append((C.PY_INDENT * indent) + s)
+                run = []
+                num_values = 0
+
             if elem == C.PY_BEGIN:
                 indent += 1
                 continue
@@ -2159,18 +2849,35 @@ class Translator:
             if elem.strip():
                 code.append((C.PY_INDENT * indent) + elem.replace('$loc$', cur_loc))
 
-        s = ''.join(text_buf)
+        s = _append_run(run)
         if s:
-            code.append((C.PY_INDENT * indent) + f'_ENV.echo({s!r})')
+            code.append((C.PY_INDENT * indent) + s)
 
-        py = C.PY_TEMPLATE
-        py = py.replace('$name$', self.cc.options.name)
+        py = py_template
+        py = py.replace('$name$', name)
         py = py.replace('$paths$', repr(self.cc.buf.paths))
+        py = py.replace('$lines$', repr(tuple(lines)))
         py = py.replace('$code$', C.NL + C.NL.join(code) + C.NL)
         py = py.replace('$loc$', cur_loc)
 
         return py
 
+    def emit_free_names(self):
+        # an undefined name stays unbound, and fails with a NameError where it's used, see Environment.error
+        code = []
+        for s in self.free_names:
+            code.extend([
+                'try:',
+                C.PY_BEGIN,
+                f'{C.PY_FREE_NAME}{s} = _ENV.get_global({s!r})',
+                C.PY_END,
+                'except NameError:',
+                C.PY_BEGIN,
+                'pass',
+                C.PY_END,
+            ])
+        return code
+
     def var(self):
         self.num_vars += 1
         return '_' + str(self.num_vars)
@@ -2186,7 +2893,11 @@ class Translator:
         return node.emit(self)
 
     def emit_try(self, block, fallback=None, mute=False):
-        exc = self.var()
+        if self.fail_fast and not mute:
+            # any error aborts the template, see Environment.fail
+            return [block]
+
+        exc = C.PY_EXC_VAR
 
         if mute:
             err = fallback or 'pass'
@@ -2204,6 +2915,27 @@ class Translator:
             C.PY_END
         ]
 
+    def emit_cond(self, n, value):
+        # the n-th condition of an @if chain and the head of its block, value is None for @else
+        if self.fail_fast:
+            # an error aborts the template, see Environment.fail
+            if value is None:
+                return 'else:'
+            return ('elif ' if n else 'if ') + value + ':'
+
+        # a failed condition is reported and counts as false, so the chain can't be a python elif,
+        # the number of the chosen branch is kept in a variable named by the nesting depth
+        var = C.PY_COND_VAR + str(self.depth)
+        if value is None:
+            return f'if {var} == 0:'
+
+        code = self.emit_try([f'if {value}:', C.PY_BEGIN, f'{var} = {n + 1}', C.PY_END])
+        if n:
+            code = [f'if {var} == 0:', C.PY_BEGIN, code, C.PY_END]
+        else:
+            code = [f'{var} = 0', code]
+        return [code, f'if {var} == {n + 1}:']
+
     def emit_assign(self, var, value, fallback='None', mute=False):
         return self.emit_try(
             f'{var} = {value}',
@@ -2212,13 +2944,147 @@ class Translator:
         )
 
     def emit_echo(self, value, mute=False):
-        res = self.var()
+        if self.fail_fast and not mute:
+            return Translator.Value(value)
+        res = C.PY_ECHO_VAR
         code = [
             f'{res} = {value}',
-            f'_ENV.echo({res})'
+            f'if {res} is not None:',
+            C.PY_BEGIN,
+            f'_APPEND({res})',
+            C.PY_END,
         ]
         return self.emit_try(code, mute=mute)
 
+    def emit_bind_append(self):
+        # the current buffer's append, bound in each function and after each push/pop
+        return '_APPEND = _ENV.buf[-1].append'
+
+    def emit_pushbuf(self):
+        return ['_ENV.pushbuf()', self.emit_bind_append()]
+
+    def emit_popbuf(self, var):
+        return [f'{var} = _ENV.popbuf()', self.emit_bind_append()]
+
+    def fold_echo(self, node: Node.Echo):
+        """Return the output of an echo made of constants and pure functions and the function names, or None."""
+
+        self.folded_names = {}
+        try:
+            val = self.fold(node.expr)
+            if node.format:
+                val = self.fold_call('format', [val, node.format], {})
+            if node.filter:
+                val = self.fold_call(node.filter, [val], {})
+            return ('' if val is None else str(val)), list(self.folded_names)
+        except Exception:
+            # not a constant, or fails at run time, where the error is located and handled
+            return None
+
+    def fold(self, node):
+        """Compute the value of a constant expression, raise `_NotConstant` if it depends on run time values."""
+
+        if isinstance(node, (Node.Const, Node.Number, Node.String)):
+            return node.value
+
+        if isinstance(node, Node.List):
+            return [self.fold(v) for v in node.items]
+
+        if isinstance(node, Node.Dict):
+            return {self.fold(k): self.fold(v) for k, v in node.items}
+
+        if isinstance(node, (Node.Or, Node.And)):
+            val = self.fold(node.subject)
+            for op, other in node.pairs:
+                if (op == 'or') == bool(val):
+                    break
+                val = self.fold(other)
+            return val
+
+        if isinstance(node, (Node.Sum, Node.Product)):
+            val = self.fold(node.subject)
+            for op, other in node.pairs:
+                val = _fold_binary_op(op, val, self.fold(other))
+            return val
+
+        if isinstance(node, Node.Power):
+            # a ** b ** c => (a ** (b ** c))
+            vals = [self.fold(node.subject)] + [self.fold(other) for _, other in node.pairs]
+            val = vals.pop()
+            while vals:
+                val = _fold_binary_op('**', vals.pop(), val)
+            return val
+
+        if isinstance(node, Node.Comparison):
+            left = self.fold(node.subject)
+            res = True
+            for op, other in node.pairs:
+                right = self.fold(other)
+                res = _fold_binary_op(op, left, right)
+                if not res:
+                    break
+                left = right
+            return res
+
+        if isinstance(node, (Node.Unary, Node.Not)):
+            val = self.fold(node.subject)
+            for op in node.ops:
+                val = C.FOLD_UNARY_OPS[op](val)
+            return val
+
+        if isinstance(node, Node.IfExpression):
+            return self.fold(node.yes if self.fold(node.cond) else node.no)
+
+        if isinstance(node, Node.Index):
+            subj = self.fold(node.subject)
+            index = [self.fold(a) if a else None for a in node.index]
+            if len(index) == 1:
+                return subj[index[0]]
+            return subj[slice(*index)]
+
+        if isinstance(node, Node.PipeList):
+            val = self.fold(node.subject)
+            for p in node.pipes:
+                if isinstance(p, Node.Name):
+                    if p.ident not in C.SAFE_FILTER:
+                        val = self.fold_call(p.ident, [val], {})
+                elif isinstance(p, Node.Call) and isinstance(p.function, Node.Name):
+                    args, kwargs = self.fold_args(p.args)
+                    val = self.fold_call(p.function.ident, [val] + args, kwargs)
+                else:
+                    raise _NotConstant()
+            return val
+
+        if isinstance(node, Node.Call) and isinstance(node.function, Node.Name):
+            args, kwargs = self.fold_args(node.args)
+            return self.fold_call(node.function.ident, args, kwargs)
+
+        raise _NotConstant()
+
+    def fold_args(self, args):
+        pos = []
+        kw = {}
+        for a in args:
+            if a.star:
+                raise _NotConstant()
+            if a.name:
+                kw[a.name] = self.fold(a.expr)
+            else:
+                pos.append(self.fold(a.expr))
+        return pos, kw
+
+    def fold_call(self, name, args, kwargs):
+        # only engine functions declared pure, unless shadowed by a template definition
+        if name in self.locals or not _is_pure(self.cc.engine, name):
+            raise _NotConstant()
+        fn = self.cc.engine.engine_functions().get(name)
+        if not fn:
+            raise _NotConstant()
+        if name == 'format' and any(_large_format(a) for a in args[1:] + list(kwargs.values())):
+            raise _NotConstant()
+        self.folded_names[name] = True
+        return fn(*args, **kwargs)
+
     def emit_left_binary_op(self, node):
         # a + b + c => ((a + b) + c)
         code = self.emit(node.subject)
@@ -2250,6 +3116,20 @@ class Translator:
         return code
 
 
+class ParseState:
+    """Source and resume points of a `parse` result, used by `reparse`."""
+
+    __slots__ = ('text', 'path', 'options', 'checkpoints', 'incremental')
+
+    def __init__(self, text, path, options, checkpoints, buf: Buffer):
+        self.text = text
+        self.path = path
+        self.options = options
+        self.checkpoints = checkpoints
+        # included texts shift buffer positions, such templates are always parsed from scratch
+        self.incremental = len(buf.segments) == 1 and len(buf.paths) == 1
+
+
 class Compiler:
     def __init__(self, engine, options):
         self.engine = engine
@@ -2259,28 +3139,297 @@ class Compiler:
         opts.update(options or {})
         self.options = Data(**opts)
 
+        # included templates are compiled with the options as passed, not changed by @option
+        self.include_options = {k: v for k, v in opts.items() if k != 'path'}
+
+        # path => version/text of every file that went into the template
+        self.deps = {}
+        self.texts = {}
+
+        # (basepath, path) => resolved path, and resolved path => (text, path, line offsets) of included files
+        # each file is loaded once per compile, however its includes are spelled
+        self.resolved = {}
+        self.includes = {}
+
+        # path => template function of templates included in the 'call' mode, see `link`
+        self.linked = {}
+
+    def run(self, cmd, text, path):
+        text, path = self.source(text, path)
+        self.buf.paste(text, path, self.buf.pos)
+
+        if self.options.prefetch:
+            self.prefetch(text, path)
+
+        if cmd == 'parse':
+            return self.parse(incremental=True)
+
+        node = self.parse()
+
+        python = self.translate(node)
+        if cmd == 'translate':
+            return python
+
+        fn = self.compile(python)
+        if cmd == 'compile':
+            return fn
+
+    def source(self, text, path):
+        if text is None:
+            loc = Location(pos=0, path=__file__, line_num=1)
+            return self.load(None, path or self.options.path, loc)
+        return text, path or self.options.path or '<string>'
+
+    def prefetch(self, text, path):
+        """Load included templates in a thread pool before parsing.
+
+        Includes are found by a regex scan, nested ones are fetched as soon as their parent is loaded.
+        Failed loads are skipped, the parser loads them again and reports the error.
+        """
+
+        scanner = SyntaxProfile.get(self.options).include_scanner
+        seen = set()
+        pending = set()
+
+        with ThreadPoolExecutor(self.options.prefetch) as ex:
+
+            def scan(text, basepath):
+                for m in scanner.finditer(text):
+                    if m.lastgroup == 'skip':
+                        continue
+                    key = basepath, _unquote(m.group(m.lastindex))
+                    if key[1] and key not in seen:
+                        seen.add(key)
+                        pending.add(ex.submit(self.try_include, *key))
+
+            scan(text, path)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    pending.discard(f)
+                    inc = f.result()
+                    if inc:
+                        scan(inc[0], inc[1])
+
+    def try_include(self, basepath, path):
+        try:
+            return self.include(basepath, path, None)
+        except Exception:
+            # also unexpected loader errors, the parser will raise them in place
+            return None
+
+    def include(self, basepath, path, loc):
+        key = basepath, path
+        resolved = self.resolved.get(key)
+        if resolved is None and self.can_resolve():
+            resolved = self.find(basepath, path, loc)
+        inc = self.includes.get(resolved)
+        if inc is None:
+            # plain loader functions can only resolve a path by loading it
+            text, resolved = self.load(basepath, path, loc)
+            self.resolved[key] = resolved
+            inc = self.includes[resolved] = text, resolved, _line_offsets(text)
+        return inc
+
+    def find(self, basepath, path, loc):
+        """Return the resolved path of an included template, memoized per compile."""
+
+        key = basepath, path
+        resolved = self.resolved.get(key)
+        if resolved is None:
+            resolved = self.resolved[key] = self.resolve(basepath, path, loc)
+        return resolved
+
+    def can_resolve(self):
+        loader = self.options.loader
+        return not callable(loader) or hasattr(loader, 'find')
+
+    def resolve(self, basepath, path, loc):
+        """Return the resolved path of a template file without loading it."""
+
+        loader = self.options.loader
+        try:
+            if callable(loader):
+                find = getattr(loader, 'find', None)
+                if not find:
+                    return loader(basepath, path)[1]
+                resolved = find(basepath, path)
+            else:
+                if not os.path.isabs(path) and basepath:
+                    path = os.path.abspath(os.path.join(os.path.dirname(basepath), path))
+                resolved = path if os.path.isfile(path) else None
+            if resolved is None:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+            return resolved
+        except OSError as exc:
+            raise CompileError(f'cannot load {path!r}: {exc.strerror or exc}', loc)
+
     def load(self, basepath, path, loc):
         try:
             if callable(self.options.loader):
-                return self.options.loader(basepath, path)
+                text, path = self.options.loader(basepath, path)
+                self.deps[path] = version(self.options.loader, path)
+                self.texts[path] = text
+                return text, path
             if not os.path.isabs(path) and basepath:
                 path = os.path.abspath(os.path.join(os.path.dirname(basepath), path))
+            # stat before reading, so that a concurrent change makes the dependency stale
+            v = version(None, path)
             with open(path, 'rt', encoding='utf8') as fp:
                 text = fp.read()
+            self.deps[path] = v
+            self.texts[path] = text
             return text, path
         except OSError as exc:
-            raise CompileError(f'cannot load {path!r}: {exc.args[1]}', loc)
+            raise CompileError(f'cannot load {path!r}: {exc.strerror or exc}', loc)
 
-    def parse(self):
-        return TemplateParser(self).parse()
+    def check(self, text, path, translate=False):
+        """Parse and optionally translate a template, return a list of all errors found."""
+
+        try:
+            text, path = self.source(text, path)
+        except CompileError as exc:
+            return [exc]
+        self.buf.paste(text, path, self.buf.pos)
+
+        tp = TemplateParser(self)
+        tp.errors = []
+        node = tp.parse()
+
+        if translate and not tp.errors:
+            try:
+                python = self.translate(node)
+                compile(python, '<string>', 'exec')
+            except CompileError as exc:
+                tp.errors.append(exc)
+            except SyntaxError as exc:
+                tp.errors.append(CompileError(exc.msg, _python_location(python, exc.lineno)))
+
+        return tp.errors
+
+    def parse(self, incremental=False):
+        tp = TemplateParser(self)
+        if not incremental:
+            return tp.parse()
+
+        text = self.buf.slice(0, self.buf.length)
+        options = dict(vars(self.options))
+        tp.checkpoints = []
+        node = tp.parse()
+        node.parse_state = ParseState(text, self.buf.paths[0], options, tp.checkpoints, self.buf)
+        return node
 
     def translate(self, node):
         return Translator(self).translate(node)
 
     def compile(self, python):
+        """Execute python source or a code object and return the template function."""
+
         local_vars = {}
-        exec(python, {}, local_vars)
-        return local_vars[self.options.name]
+        exec(python, self.globals(), local_vars)
+        template_fn = local_vars[self.options.name]
+        self.link(template_fn)
+        return template_fn
+
+    def link(self, template_fn):
+        """Compile the templates included in the 'call' mode and add their files to the dependencies.
+
+        Linked functions are called directly, changes in them are detected by the cache entry of the including template.
+        Recursive includes and templates that fail to compile are left to the include function.
+        """
+
+        linking = _linking.__dict__.setdefault('paths', set())
+        for path in getattr(template_fn, 'includes', ()):
+            if path in linking:
+                continue
+            linking.add(path)
+            try:
+                self.linked[path], deps = self.engine.compile_include(path, self.include_options)
+            except Exception:
+                # reported at the include site when rendering
+                continue
+            finally:
+                linking.discard(path)
+            self.deps.update(deps)
+
+    def globals(self):
+        """Return the global names used by the template code, other than the function arguments."""
+
+        return {'_INCLUDE': self.include_function(), '_LOADER': self.options.loader}
+
+    def include_function(self):
+        """Return a function `path => template function` for includes in the 'call' mode."""
+
+        from . import cache
+
+        engine = self.engine
+        options = self.include_options
+        fns = self.linked
+
+        if engine.cache.size > 0 and cache.options_key(options) is not None:
+            def include(path):
+                fn = fns.get(path)
+                if fn is None:
+                    # not linked, compiled once and shared by all templates through the engine cache
+                    fn = engine.compile_path(path, **options)
+                return fn
+
+            return include
+
+        # without the engine cache, compiled once per template function
+
+        def include(path):
+            fn = fns.get(path)
+            if fn is None:
+                fn = fns[path] = engine.compile_path(path, **options)
+            return fn
+
+        return include
+
+
+class _NotConstant(Exception):
+    pass
+
+
+# paths being linked in the current thread, see `Compiler.link`
+_linking = threading.local()
+
+
+def _is_pure(engine, name):
+    # a function declared pure can still be overridden in a subclass, which doesn't redeclare `pure_functions`
+    if name not in engine.pure_functions:
+        return False
+    if 'pure_functions' in vars(engine):
+        return True
+    cls = type(engine)
+    decl = next(c for c in cls.__mro__ if 'pure_functions' in vars(c))
+    return all(
+        getattr(cls, a, None) is getattr(decl, a, None)
+        for a in (cmd + '_' + name for cmd in C.DEF_COMMANDS)
+    )
+
+
+def _fold_binary_op(op, a, b):
+    # refuse to build huge values at compile time, like `'x' * 10**9`
+    if op == '*':
+        for seq, n in (a, b), (b, a):
+            if isinstance(seq, (str, list, tuple)) and isinstance(n, int) and len(seq) * n > C.FOLD_MAX_SIZE:
+                raise _NotConstant()
+    if op == '**' and isinstance(a, int) and isinstance(b, int) and abs(a).bit_length() * b > C.FOLD_MAX_SIZE:
+        raise _NotConstant()
+    if op == '%' and _large_format(a):
+        raise _NotConstant()
+    return C.FOLD_BINARY_OPS[op](a, b)
+
+
+def _large_format(fmt):
+    # like `'%0999999999d' % 1`, `*` takes the width from the arguments
+    if not isinstance(fmt, str):
+        return False
+    for m in C.RE_FOLD_FORMAT_SIZE.findall(fmt):
+        if m == '*' or int(m) > C.FOLD_MAX_SIZE:
+            return True
+    return False
 
 
 def _dedent(lines):
@@ -2309,6 +3458,40 @@ def _flatten(ls):
             yield from _flatten(item)
 
 
+def _python_location(python, lineno):
+    # the nearest location marker above the generated line
+    loc = None
+    for ln in python.split(C.NL)[:lineno]:
+        if ln.startswith(C.PY_MARKER):
+            path, _, line = ln[len(C.PY_MARKER):].rpartition(':')
+            loc = Location(path=path, line_num=int(line))
+    return loc
+
+
+def _append_run(run):
+    if all(isinstance(p, str) for p in run):
+        s = ''.join(run)
+        return f'_APPEND({s!r})' if s else ''
+
+    # an f-string with the None => '' rule of `Environment.echo`
+    fs = ''
+    for p in run:
+        if isinstance(p, str):
+            fs += _fstring_text(p)
+        else:
+            fs += f"{{'' if {p.var} is None else {p.var}!s}}"
+    return f'_APPEND(f"{fs}")'
+
+
+def _fstring_text(s):
+    r = repr(s)
+    if r[0] == "'":
+        r = r[1:-1].replace('"', '\\"')
+    else:
+        r = r[1:-1]
+    return r.replace('{', '{{').replace('}', '}}')
+
+
 def _path_line(path, line):
     s = repr(path)[1:-1]
     return s + ':' + str(line)
@@ -2322,6 +3505,68 @@ def _unquote(s):
     return s.strip('\'\" ')
 
 
+def _line_offsets(text):
+    offsets = []
+    text_len = len(text)
+    p = 0
+    while p < text_len:
+        offsets.append(p)
+        p = text.find(C.NL, p)
+        if p < 0:
+            break
+        p += 1
+    return offsets
+
+
+_plain_chars = {}
+
+
+def _plain_chars_regex(end_sym):
+    if end_sym not in _plain_chars:
+        _plain_chars[end_sym] = re.compile('[^\\\\\\n' + re.escape(end_sym[:1]) + ']*')
+    return _plain_chars[end_sym]
+
+
+_LINE_ELEMENTS = {'comment', 'command'}
+
+_engine_bindings_cache = {}
+
+
+def _engine_bindings(engine):
+    # name => [command, engine attribute] for `def_*` etc. methods
+    cls = type(engine)
+    bindings = _engine_bindings_cache.get(cls)
+    if bindings is None:
+        bindings = _engine_bindings_cache[cls] = _find_bindings(dir(cls))
+    extra = [a for a in getattr(engine, '__dict__', ()) if '_' in a]
+    if extra:
+        bindings = dict(bindings, **_find_bindings(extra))
+    return bindings
+
+
+def _find_bindings(names):
+    bindings = {}
+    for a in names:
+        if '_' in a:
+            cmd, _, name = a.partition('_')
+            if cmd in C.DEF_COMMANDS:
+                bindings[name] = [cmd, a]
+    return bindings
+
+
+def _shift_nodes(nodes, delta, line_delta, seen):
+    for node in nodes:
+        if isinstance(node, Node.Location):
+            node.line_num += line_delta
+        elif isinstance(node, (Node.Echo, Node.Command)):
+            node.start_pos += delta
+        if isinstance(node, Node.BlockCommand):
+            for block in node.blocks + [node.children]:
+                if id(block) not in seen:
+                    seen.add(id(block))
+                    _shift_nodes(block, delta, line_delta, seen)
+
+
 def _cut(s, maxlen):
     if len(s) <= maxlen:
         return s
@@ -1,5 +1,6 @@
 """Basic runtime"""
 
+import bisect
 import html
 import json
 import re
@@ -7,7 +8,7 @@ import string
 import builtins
 from collections import abc
 
-from . import compiler
+from . import cache, check, compiler
 
 builtins_dct = {k: getattr(builtins, k) for k in dir(builtins)}
 
@@ -40,24 +41,29 @@ class Environment:
         self.paths = paths
         self.ARGS = self.prepare(args)
 
-        self.engine_functions = {}
-
-        for a in dir(self.engine):
-            if '_' in a:
-                cmd, _, name = a.partition('_')
-                if cmd in compiler.C.DEF_COMMANDS:
-                    self.engine_functions[name] = getattr(self.engine, a)
+        self.engine_functions = engine.engine_functions()
 
         if errorhandler:
 
             def err_with_handler(exc, pos):
+                if getattr(exc, '_jump_reported', False):
+                    # already passed to the handler where it occurred, e.g. in an included template
+                    raise
+                name_exc = _free_name_error(exc)
                 try:
-                    ok = errorhandler(exc, self.paths[pos[0]], pos[1], self)
+                    ok = errorhandler(name_exc, self.paths[pos[0]], pos[1], self)
+                except Exception as handler_exc:
+                    self.haserr = True
+                    handler_exc._jump_reported = True
+                    raise
                 except:
                     self.haserr = True
                     raise
                 if not ok:
                     self.haserr = True
+                    name_exc._jump_reported = True
+                    if name_exc is not exc:
+                        raise name_exc from None
                     raise
 
             self.error = err_with_handler
@@ -65,12 +71,32 @@ class Environment:
 
             def err(exc, pos):
                 self.haserr = True
+                exc = _free_name_error(exc)
                 if isinstance(exc, RuntimeError):
                     raise exc
                 raise RuntimeError(str(exc), self.paths[pos[0]], pos[1]) from exc
 
             self.error = err
 
+    def fail(self, exc, lines):
+        """Raise an error from a fail-fast template function, `lines` maps python lines to template lines."""
+
+        # the traceback starts in the template function, find the innermost frame of the same template
+        tb = exc.__traceback__
+        base = tb.tb_frame.f_code.co_firstlineno
+        glob = tb.tb_frame.f_globals
+        lineno = tb.tb_lineno
+        while tb:
+            if tb.tb_frame.f_globals is glob:
+                lineno = tb.tb_lineno
+            tb = tb.tb_next
+
+        pos = (0, 0)
+        i = bisect.bisect_right(lines, (lineno - base, len(self.paths), 0)) - 1
+        if i >= 0:
+            pos = lines[i][1:]
+        self.error(exc, pos)
+
     def pushbuf(self):
         self.buf.append([])
 
@@ -93,6 +119,13 @@ class Environment:
             return builtins_dct[name]
         raise NameError(f'name {name!r} is not defined')
 
+    def get_global(self, name):
+        if name in self.engine_functions:
+            return self.engine_functions[name]
+        if name in builtins_dct:
+            return builtins_dct[name]
+        raise NameError(f'name {name!r} is not defined')
+
     def attr(self, obj, prop):
         try:
             return obj[prop]
@@ -160,15 +193,83 @@ class Environment:
 class BaseEngine:
     """Basic runtime."""
 
+    cache_size = 256
+    """Max number of compiled templates kept in memory, 0 disables caching."""
+
+    cache_dir = None
+    """Directory for the persistent bytecode cache, None disables it."""
+
+    pure_functions = frozenset()
+    """Names of template functions that only depend on their arguments, called at compile time when the arguments are constant.
+
+    A function overridden in a subclass is only called if the subclass redeclares `pure_functions`.
+    """
+
+    watcher = None
+
+    def __init__(self, cache_size=None, cache_dir=None):
+        self._cache = cache.MemoryCache(self.cache_size if cache_size is None else cache_size)
+        self._blobs = cache.BlobCache()
+        cache_dir = cache_dir or self.cache_dir
+        self._disk_cache = cache.DiskCache(cache_dir) if cache_dir else None
+
+    # caches are created on first use in subclasses that don't call `BaseEngine.__init__`
+
+    @property
+    def cache(self):
+        """Compiled template functions, see `cache_size`."""
+
+        if '_cache' not in self.__dict__:
+            self._cache = cache.MemoryCache(self.cache_size)
+        return self._cache
+
+    @property
+    def blobs(self):
+        """Contents of `@embed`ded files."""
+
+        if '_blobs' not in self.__dict__:
+            self._blobs = cache.BlobCache()
+        return self._blobs
+
+    @property
+    def disk_cache(self):
+        """Persistent bytecode cache, see `cache_dir`."""
+
+        if '_disk_cache' not in self.__dict__:
+            self._disk_cache = cache.DiskCache(self.cache_dir) if self.cache_dir else None
+        return self._disk_cache
+
     def environment(self, paths, args, errorhandler):
         return Environment(self, paths, args, errorhandler)
 
+    def engine_functions(self):
+        """Return a dict `name => function` of template functions (`def_*` etc. methods), computed once per engine."""
+
+        fns = self.__dict__.get('_engine_functions')
+        if fns is None:
+            fns = {}
+            for a in dir(self):
+                if '_' in a:
+                    cmd, _, name = a.partition('_')
+                    if cmd in compiler.C.DEF_COMMANDS:
+                        fns[name] = getattr(self, a)
+            self._engine_functions = fns
+        return fns
+
     def parse(self, text, **options):
         return compiler.do('parse', self, options, text, None)
 
     def parse_path(self, path, **options):
         return compiler.do('parse', self, options, None, path)
 
+    def check_paths(self, paths, workers=None, translate=False, **options):
+        """Check templates, directories or glob patterns in parallel and return a list of all `CompileError`s."""
+
+        return check.check_paths(self, paths, workers, translate, options)
+
+    def reparse(self, tree, offset, removed, inserted):
+        return compiler.reparse(self, tree, offset, removed, inserted)
+
     def translate(self, text, **options):
         return compiler.do('translate', self, options, text, None)
 
@@ -176,12 +277,81 @@ class BaseEngine:
         return compiler.do('translate', self, options, None, path)
 
     def compile(self, text, **options):
-        return compiler.do('compile', self, options, text, None)
+        if text is None:
+            key = cache.path_key(None, options)
+        else:
+            key = cache.text_key(text, options)
+        return self.cached_compile(key, options, text, None)
 
     def compile_path(self, path, **options):
-        return compiler.do('compile', self, options, None, path)
+        return self.cached_compile(cache.path_key(path, options), options, None, path)
+
+    def cached_compile(self, key, options, text, path):
+        if key is None:
+            return compiler.do('compile', self, options, text, path)
+
+        template_fn = self.cache.get(key)
+        if template_fn is None:
+            template_fn, deps, loader = self.compile_source(options, text, path)
+            self.cache.put(key, template_fn, deps, loader, (options, text, path))
+        return template_fn
+
+    def compile_include(self, path, options):
+        """Return the function and dependencies of a template included in the 'call' mode.
+
+        Cached functions are always checked for changes, also when a `Watcher` is running,
+        because the including template keeps calling the function it got here.
+        """
+
+        key = cache.path_key(path, options)
+        e = self.cache.lookup(key, True) if key is not None else None
+        if e:
+            return e.fn, e.deps
+        template_fn, deps, loader = self.compile_source(options, None, path)
+        if key is not None:
+            self.cache.put(key, template_fn, deps, loader, (options, None, path))
+        return template_fn, deps
+
+    def compile_source(self, options, text, path):
+        cc = compiler.Compiler(self, options)
+        if self.disk_cache:
+            template_fn, deps = self.disk_cache.compile(cc, text, path)
+        else:
+            template_fn, deps = cc.run('compile', text, path), cc.deps
+        return template_fn, deps, cc.options.loader
+
+    def watch(self, interval=1.0):
+        """Recompile changed templates in a background thread, instead of checking them on each call."""
+
+        if not self.watcher:
+            self.watcher = cache.Watcher(self, interval)
+            self.cache.check = False
+            self.watcher.start()
+
+    def unwatch(self):
+        if self.watcher:
+            self.watcher.stop()
+            self.watcher = None
+            self.cache.check = True
+
+    def preload(self, paths, workers=None, **options):
+        """Compile templates matching glob patterns in parallel and put them into the cache.
+
+        Returns a list of results with `path`, `time` and `error` (a `CompileError` or None) for each template.
+        The engine class must be constructible without arguments in worker processes.
+        """
+
+        return cache.preload(self, paths, workers, options)
+
+    def embed(self, path, loader=None):
+        """Return the content of an `@embed`ded file, kept in memory until the file changes."""
+
+        return self.blobs.get(loader, path)
 
     def call(self, template_fn, args=None, error=None):
+        if error is None:
+            # templates compiled with `fail_fast` have a faster variant for when errors aren't handled
+            template_fn = getattr(template_fn, 'fail_fast', None) or template_fn
         return template_fn(self, args, error)
 
     def render(self, text, args=None, error=None, **options):
@@ -196,6 +366,12 @@ class BaseEngine:
 class Engine(BaseEngine):
     """Basic runtime with default filters"""
 
+    pure_functions = frozenset([
+        'raw', 'safe', 'as_int', 'as_float', 'as_str', 'xml', 'xmlq', 'html', 'htmlq', 'h', 'unhtml',
+        'nl2br', 'nl2p', 'url', 'strip', 'upper', 'lower', 'titlecase', 'linkify', 'format', 'cut',
+        'shorten', 'json', 'slice', 'join', 'spaces', 'commas', 'split', 'lines', 'sort',
+    ])
+
     def def_raw(self, val):
         return _str(val)
 
@@ -377,3 +553,15 @@ def _xml(x, quote=False):
         x = x.replace('"', '&#x22;')
         x = x.replace("'", '&#x27;')
     return x
+
+
+_free_name_re = re.compile(r"'" + compiler.C.PY_FREE_NAME + r"(\w+)'")
+
+
+def _free_name_error(exc):
+    # an undefined free name fails as an unbound `_F_name` local, report it like a missing global
+    if isinstance(exc, NameError):
+        m = _free_name_re.search(str(exc))
+        if m:
+            return NameError(f'name {m.group(1)!r} is not defined')
+    return exc
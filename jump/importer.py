@@ -0,0 +1,201 @@
+"""Import hook for templates.
+
+Once installed, template files on `sys.path` or in package directories can be imported as modules.
+The module `render` attribute is the compiled template function::
+
+    jump.importer.install()
+
+    from myapp.templates import index   # myapp/templates/index.jump
+
+    output = jump.call(index.render, args)
+
+Compiled modules are cached in `__pycache__` like regular python modules.
+A module is recompiled when its template file or the `jump` compiler changes,
+but not when an `@include`d file changes, use `importlib.reload` in this case.
+
+Templates can also be imported from zip archives on `sys.path`, like zipapps.
+Their `@include`s and `@embed`s are read from the same archive, and compiled modules aren't cached.
+"""
+
+import importlib.machinery
+import importlib.util
+import os
+import posixpath
+import sys
+import zipfile
+import zipimport
+
+from . import compiler, loaders
+
+DEFAULT_EXTENSIONS = ('.jump', '.tpl')
+
+
+class TemplateLoader(importlib.machinery.SourceFileLoader):
+    def __init__(self, fullname, path, engine, options=None):
+        super().__init__(fullname, path)
+        self.engine = engine
+        self.options = dict(options or {}, path=path, name='render')
+
+    def source_to_code(self, data, path, *, _optimize=-1):
+        python = self.engine.translate(data.decode('utf8'), **self.options)
+        return compile(python, path, 'exec', dont_inherit=True, optimize=_optimize)
+
+    def exec_module(self, module):
+        # includes in the 'call' mode and embeds are resolved by the engine, like in `Compiler.compile`
+        cc = compiler.Compiler(self.engine, self.options)
+        vars(module).update(cc.globals())
+        super().exec_module(module)
+        cc.link(module.render)
+
+    def path_stats(self, path):
+        st = super().path_stats(path)
+        # recompile when the compiler changes
+        st['mtime'] = max(st['mtime'], os.stat(compiler.__file__).st_mtime)
+        return st
+
+    # default bytecode paths for 'foo.jump' and 'foo.py' are the same, use 'foo.jump.*.pyc' instead
+
+    def get_data(self, path):
+        return super().get_data(self.bytecode_path(path))
+
+    def set_data(self, path, data, *args, **kwargs):
+        return super().set_data(self.bytecode_path(path), data, *args, **kwargs)
+
+    def bytecode_path(self, path):
+        if path == importlib.util.cache_from_source(self.path):
+            return importlib.util.cache_from_source(self.path + '.py')
+        return path
+
+
+class ArchiveTemplateLoader(TemplateLoader):
+    """Loads a template from a zip archive, the compiled module is not cached."""
+
+    def __init__(self, fullname, path, engine, archive_loader):
+        super().__init__(fullname, path, engine, {'loader': archive_loader})
+        self.archive_loader = archive_loader
+
+    def path_stats(self, path):
+        # no bytecode, see `SourceLoader.get_code`
+        raise OSError(f'{path!r} is in an archive')
+
+    def get_data(self, path):
+        return self.archive_loader.read_bytes(path)
+
+    def set_data(self, path, data, *args, **kwargs):
+        pass
+
+
+class ArchiveLoader(loaders.Loader):
+    """Loads templates from a zip archive, paths are `archive/member`, like module `__file__`s.
+
+    Relative paths are looked up in the directory of the current template first, and then in the archive root.
+    """
+
+    def __init__(self, archive, ttl=1.0, encoding='utf8'):
+        super().__init__(ttl)
+        self.archive = archive
+        self.prefix = archive + os.sep
+        self.encoding = encoding
+        with zipfile.ZipFile(archive) as zf:
+            self.members = set(zf.namelist())
+
+    def resolve(self, current_path, path):
+        if path.startswith(self.prefix):
+            return path if self.exists(path) else None
+
+        names = [path]
+        if current_path and current_path.startswith(self.prefix):
+            names.insert(0, posixpath.join(posixpath.dirname(self.member(current_path)), path))
+        for name in names:
+            name = posixpath.normpath(name)
+            if name == '..' or name.startswith('../') or posixpath.isabs(name):
+                continue
+            p = self.prefix + name.replace('/', os.sep)
+            if self.exists(p):
+                return p
+
+    def stat(self, path):
+        # archives don't change
+        if path.startswith(self.prefix) and self.member(path) in self.members:
+            return 0
+
+    def read(self, path):
+        return self.read_bytes(path).decode(self.encoding)
+
+    def read_bytes(self, path):
+        with zipfile.ZipFile(self.archive) as zf:
+            return zf.read(self.member(path))
+
+    def member(self, path):
+        return path[len(self.prefix):].replace(os.sep, '/')
+
+
+class TemplateFinder:
+    def __init__(self, extensions, engine):
+        self.extensions = extensions
+        self.engine = engine
+        self.archive_loaders = {}
+
+    def find_spec(self, fullname, path=None, target=None):
+        name = fullname.rpartition('.')[2]
+
+        for entry in sys.path if path is None else path:
+            if not isinstance(entry, str):
+                continue
+            if not os.path.isdir(entry or '.'):
+                spec = self.find_archive_spec(fullname, name, entry)
+                if spec:
+                    return spec
+                continue
+            for ext in self.extensions:
+                file_path = os.path.join(entry or '.', name + ext)
+                if os.path.isfile(file_path):
+                    loader = TemplateLoader(fullname, file_path, self.engine)
+                    return importlib.util.spec_from_file_location(fullname, file_path, loader=loader)
+
+    def find_archive_spec(self, fullname, name, entry):
+        # `entry` is an archive or a directory in it, like a package `__path__`
+        try:
+            zi = zipimport.zipimporter(entry)
+        except zipimport.ZipImportError:
+            return None
+
+        archive_loader = self.archive_loaders.get(zi.archive)
+        if archive_loader is None:
+            archive_loader = self.archive_loaders[zi.archive] = ArchiveLoader(zi.archive)
+
+        for ext in self.extensions:
+            file_path = os.path.join(entry, name + ext)
+            if archive_loader.exists(file_path):
+                loader = ArchiveTemplateLoader(fullname, file_path, self.engine, archive_loader)
+                return importlib.util.spec_from_file_location(fullname, file_path, loader=loader)
+
+    def invalidate_caches(self):
+        self.archive_loaders = {}
+
+
+_finder = None
+
+
+def install(extensions=DEFAULT_EXTENSIONS, engine=None):
+    """Enable importing templates with given file extensions."""
+
+    global _finder
+
+    uninstall()
+    if engine is None:
+        import jump
+        engine = jump.engine()
+
+    # regular modules take precedence
+    _finder = TemplateFinder(tuple(extensions), engine)
+    sys.meta_path.append(_finder)
+    return _finder
+
+
+def uninstall():
+    global _finder
+
+    if _finder in sys.meta_path:
+        sys.meta_path.remove(_finder)
+    _finder = None
@@ -0,0 +1,188 @@
+"""Template loaders.
+
+A loader is a callable `loader(current_path, path) -> (text, resolved_path)`, passed as the `loader` option.
+It raises `OSError` if the template cannot be found.
+Loaders also provide `version(resolved_path)`, which is used to detect stale compiled templates.
+"""
+
+import errno
+import hashlib
+import importlib.resources
+import os
+import pathlib
+import posixpath
+import stat
+import time
+
+
+class Loader:
+    """Base loader with cached path resolution, versions and texts.
+
+    Subclasses implement `resolve`, `stat` and `read`.
+    Results of `resolve` and `stat` are reused for `ttl` seconds.
+    """
+
+    def __init__(self, ttl=1.0):
+        self.ttl = ttl
+        self.resolved = {}
+        self.versions = {}
+        self.texts = {}
+
+    def __call__(self, current_path, path):
+        resolved = self.find(current_path, path)
+        if resolved is None:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+
+        v = self.version(resolved)
+        cached = self.texts.get(resolved)
+        if cached and v is not None and cached[0] == v:
+            return cached[1], resolved
+
+        text = self.read(resolved)
+        self.texts[resolved] = v, text
+        return text, resolved
+
+    def find(self, current_path, path):
+        key = current_path, path
+        now = time.monotonic()
+        e = self.resolved.get(key)
+        if e and now - e[0] < self.ttl:
+            return e[1]
+        resolved = self.resolve(current_path, path)
+        self.resolved[key] = now, resolved
+        return resolved
+
+    def version(self, path):
+        now = time.monotonic()
+        e = self.versions.get(path)
+        if e and now - e[0] < self.ttl:
+            return e[1]
+        v = self.stat(path)
+        self.versions[path] = now, v
+        return v
+
+    def exists(self, path):
+        return self.version(path) is not None
+
+    def clear(self):
+        self.resolved = {}
+        self.versions = {}
+        self.texts = {}
+
+    def resolve(self, current_path, path):
+        """Return the resolved path or None if the template doesn't exist."""
+
+    def stat(self, path):
+        """Return a version token for an existing path or None."""
+
+    def read(self, path):
+        """Return the text of a resolved path."""
+
+
+class FileSystemLoader(Loader):
+    """Loads templates from the file system.
+
+    Relative paths are looked up in the directory of the current template first, and then in `search_path` directories.
+    """
+
+    def __init__(self, search_path=None, ttl=1.0, encoding='utf8'):
+        super().__init__(ttl)
+        if isinstance(search_path, (str, os.PathLike)):
+            search_path = [search_path]
+        self.search_path = [os.path.abspath(p) for p in search_path or []]
+        self.encoding = encoding
+
+    def resolve(self, current_path, path):
+        if os.path.isabs(path):
+            return path if self.exists(path) else None
+
+        dirs = list(self.search_path)
+        if current_path and os.path.isabs(current_path):
+            dirs.insert(0, os.path.dirname(current_path))
+
+        for d in dirs:
+            p = os.path.normpath(os.path.join(d, path))
+            if self.exists(p):
+                return p
+
+    def stat(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def read(self, path):
+        with open(path, 'rt', encoding=self.encoding) as fp:
+            return fp.read()
+
+
+class DictLoader(Loader):
+    """Loads templates from a dict `path => text`."""
+
+    def __init__(self, templates, ttl=0):
+        super().__init__(ttl)
+        self.templates = templates
+        self.digests = {}
+
+    def resolve(self, current_path, path):
+        names = [path]
+        if current_path:
+            names.insert(0, posixpath.normpath(posixpath.join(posixpath.dirname(current_path), path)))
+        for name in names:
+            if self.exists(name):
+                return name
+
+    def stat(self, path):
+        text = self.templates.get(path)
+        if text is None:
+            return None
+        # a digest is stable across processes, unlike hash(), and computed once per text
+        e = self.digests.get(path)
+        if e is None or e[0] is not text:
+            e = self.digests[path] = text, hashlib.sha1(text.encode('utf8')).hexdigest()
+        return e[1]
+
+    def read(self, path):
+        return self.templates[path]
+
+
+class PackageLoader(Loader):
+    """Loads templates from a directory in a python package, which can also be a zip archive."""
+
+    def __init__(self, package, directory='templates', ttl=1.0, encoding='utf8'):
+        super().__init__(ttl)
+        self.root = importlib.resources.files(package).joinpath(directory)
+        self.prefix = str(self.root) + '/'
+        self.encoding = encoding
+
+    def resolve(self, current_path, path):
+        names = [path]
+        if current_path and current_path.startswith(self.prefix):
+            names.insert(0, posixpath.join(posixpath.dirname(current_path[len(self.prefix):]), path))
+        for name in names:
+            name = posixpath.normpath(name)
+            if name == '..' or name.startswith('../') or posixpath.isabs(name):
+                continue
+            p = self.prefix + name
+            if self.exists(p):
+                return p
+
+    def stat(self, path):
+        node = self.node(path)
+        if isinstance(node, pathlib.Path):
+            try:
+                st = node.stat()
+            except OSError:
+                return None
+            return (st.st_mtime_ns, st.st_size) if node.is_file() else None
+        # archives don't change
+        return 0 if node.is_file() else None
+
+    def read(self, path):
+        return self.node(path).read_text(encoding=self.encoding)
+
+    def node(self, path):
+        return self.root.joinpath(*path[len(self.prefix):].split('/'))
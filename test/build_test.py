@@ -0,0 +1,100 @@
+import importlib
+import sys
+
+from . import yy
+
+from jump import build
+
+
+def _import(tmpdir, name):
+    sys.path.insert(0, tmpdir.strpath)
+    try:
+        return importlib.import_module(name)
+    finally:
+        sys.path.pop(0)
+
+
+def test_build(tmpdir):
+    src = tmpdir.mkdir('src')
+    src.join('index.jump').write('I<{@include parts/part.tpl}>{x}')
+    src.mkdir('parts').join('part.tpl').write('P')
+    src.join('readme.txt').write('not a template')
+
+    errors = build.build(src.strpath, tmpdir.join('built_pkg_1').strpath)
+    assert errors == []
+
+    pkg = _import(tmpdir, 'built_pkg_1')
+    assert sorted(pkg.TEMPLATES) == ['index.jump', 'parts/part.tpl']
+    assert pkg.render('index.jump', {'x': 'X'}) == 'I<P>X'
+    assert pkg.get('parts/part.tpl')(yy.jump.engine(), {}) == 'P'
+
+
+def test_build_errors(tmpdir):
+    src = tmpdir.mkdir('src')
+    src.join('ok.jump').write('ok')
+    src.join('bad.jump').write('{1+}')
+
+    errors = build.build(src.strpath, tmpdir.join('built_pkg_2').strpath)
+    assert len(errors) == 1
+    assert errors[0].path.endswith('bad.jump')
+
+    pkg = _import(tmpdir, 'built_pkg_2')
+    assert list(pkg.TEMPLATES) == ['ok.jump']
+
+
+def test_main(tmpdir, capsys):
+    src = tmpdir.mkdir('src')
+    src.join('a.html').write('{x}')
+    src.join('b.jump').write('@if')
+
+    rc = build.main([src.strpath, tmpdir.join('built_pkg_3').strpath, '--pattern', '*.html'])
+    assert rc == 0
+
+    pkg = _import(tmpdir, 'built_pkg_3')
+    assert pkg.render('a.html', {'x': 1}) == '1'
+
+    rc = build.main([src.strpath, tmpdir.join('built_pkg_4').strpath])
+    assert rc == 1
+    assert 'b.jump' in capsys.readouterr().err
+
+
+def test_build_fail_fast(tmpdir):
+    src = tmpdir.mkdir('src')
+    src.join('a.jump').write('A{x.y}')
+
+    errors = build.build(src.strpath, tmpdir.join('built_pkg_fast').strpath, fail_fast=True)
+    assert errors == []
+
+    # the variant is a function in the module, compiled to bytecode with it
+    pkg = _import(tmpdir, 'built_pkg_fast')
+    fn = pkg.get('a.jump')
+    assert fn.fail_fast is vars(sys.modules[fn.__module__])['render_fail_fast']
+    with yy.raises_runtime_error("has no attribute 'y' in .*a.jump:1"):
+        pkg.render('a.jump', {'x': 1})
+
+
+def test_build_include_call(tmpdir):
+    src = tmpdir.mkdir('src')
+    src.join('page.jump').write('<{@include parts/head.html}>{x}')
+    src.mkdir('parts').join('head.html').write('H{x}{@include foot.html}')
+    src.join('parts', 'foot.html').write('F')
+
+    errors = build.build(src.strpath, tmpdir.join('built_pkg_5').strpath, include_mode='call')
+    assert errors == []
+
+    pkg = _import(tmpdir, 'built_pkg_5')
+    assert sorted(pkg.TEMPLATES) == ['page.jump', 'parts/foot.html', 'parts/head.html']
+    assert pkg.render('page.jump', {'x': 1}) == '<H1F>1'
+
+
+def test_build_embed(tmpdir):
+    src = tmpdir.mkdir('src')
+    src.join('page.jump').write('<{@embed data.txt}>')
+    src.join('data.txt').write('{x}')
+
+    for n, opts in enumerate([{}, {'loader': yy.jump.loaders.FileSystemLoader(src.strpath)}], 6):
+        errors = build.build(src.strpath, tmpdir.join(f'built_pkg_{n}').strpath, **opts)
+        assert errors == []
+
+        pkg = _import(tmpdir, f'built_pkg_{n}')
+        assert pkg.render('page.jump') == '<{x}>'
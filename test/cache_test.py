@@ -0,0 +1,364 @@
+import os
+import threading
+import time
+
+from . import yy
+
+from jump import cache
+
+
+def test_compile_cached():
+    eng = yy.jump.Engine()
+    a = eng.compile('{x}')
+    b = eng.compile('{x}')
+    c = eng.compile('{x}', strip=True)
+    assert a is b
+    assert a is not c
+    assert eng.cache.info() == dict(hits=1, misses=2, size=2, maxsize=eng.cache_size)
+
+
+def test_render_cached():
+    eng = yy.jump.Engine()
+    assert eng.render('{x}', {'x': 1}) == '1'
+    assert eng.render('{x}', {'x': 2}) == '2'
+    assert eng.cache.hits == 1
+    assert eng.cache.misses == 1
+
+
+def test_lru_eviction():
+    eng = yy.jump.Engine(cache_size=2)
+    a = eng.compile('a')
+    eng.compile('b')
+    eng.compile('a')
+    eng.compile('c')
+    assert eng.compile('a') is a
+    assert eng.cache.info()['size'] == 2
+    eng.compile('b')
+    assert eng.cache.misses == 4
+
+
+def test_cache_disabled():
+    eng = yy.jump.Engine(cache_size=0)
+    assert eng.compile('a') is not eng.compile('a')
+    assert eng.cache.info()['size'] == 0
+
+
+def test_subclass_without_init(tmpdir):
+    class E(yy.jump.Engine):
+        cache_dir = tmpdir.strpath
+
+        def __init__(self):
+            self.greeting = 'hi'
+
+    eng = E()
+    tmpdir.join('data').write('D')
+    assert eng.render('{greeting}{@embed data}', {'greeting': 'hi'}, path=tmpdir.join('main').strpath) == 'hiD'
+    assert eng.cache.info()['size'] == 1
+    assert eng.disk_cache.directory == tmpdir.strpath
+    assert eng.watcher is None
+
+
+def test_unhashable_options_bypass_cache():
+    eng = yy.jump.Engine()
+    fn = eng.compile('{x}', extra=[1])
+    assert fn is not eng.compile('{x}', extra=[1])
+    assert eng.cache.info()['size'] == 0
+
+
+def test_threads():
+    eng = yy.jump.Engine(cache_size=10)
+    res = []
+
+    def run():
+        for n in range(50):
+            res.append(eng.render('{x}', {'x': n % 20}))
+
+    ts = [threading.Thread(target=run) for _ in range(8)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+
+    assert len(res) == 400
+    assert eng.cache.hits + eng.cache.misses == 400
+    assert eng.cache.info()['size'] == 1
+
+
+def test_path_cache_invalidated_by_include(tmpdir):
+    tmpdir.join('a').write('A<{@include inc}>')
+    tmpdir.join('b').write('B')
+    tmpdir.join('inc').write('1')
+
+    eng = yy.jump.Engine()
+    a = eng.compile_path(tmpdir.join('a').strpath)
+    b = eng.compile_path(tmpdir.join('b').strpath)
+    assert eng.compile_path(tmpdir.join('a').strpath) is a
+    assert eng.render_path(tmpdir.join('a').strpath) == 'A<1>'
+
+    tmpdir.join('inc').write('22')
+
+    assert eng.render_path(tmpdir.join('a').strpath) == 'A<22>'
+    assert eng.compile_path(tmpdir.join('a').strpath) is not a
+    assert eng.compile_path(tmpdir.join('b').strpath) is b
+
+
+def test_text_cache_invalidated_by_include(tmpdir):
+    tmpdir.join('inc').write('1')
+    t = '{@include ' + tmpdir.join('inc').strpath + '}'
+
+    eng = yy.jump.Engine()
+    assert eng.render(t) == '1'
+    tmpdir.join('inc').write('22')
+    assert eng.render(t) == '22'
+
+
+def test_path_cache_missing_file(tmpdir):
+    tmpdir.join('a').write('A')
+
+    eng = yy.jump.Engine()
+    assert eng.render_path(tmpdir.join('a').strpath) == 'A'
+    tmpdir.join('a').remove()
+    with yy.raises_compiler_error('cannot load'):
+        eng.render_path(tmpdir.join('a').strpath)
+
+
+def test_loader_version():
+    class Loader:
+        def __init__(self):
+            self.files = {'main': 'M<{@include inc}>', 'inc': 'v1'}
+            self.versions = {'main': 1, 'inc': 1}
+
+        def __call__(self, cur_path, path):
+            return self.files[path], path
+
+        def version(self, path):
+            return self.versions[path]
+
+    ld = Loader()
+    eng = yy.jump.Engine()
+    assert eng.render_path('main', loader=ld) == 'M<v1>'
+
+    ld.files['inc'] = 'v2'
+    assert eng.render_path('main', loader=ld) == 'M<v1>'
+
+    ld.versions['inc'] = 2
+    assert eng.render_path('main', loader=ld) == 'M<v2>'
+
+
+def test_loader_without_version():
+    files = {'main': 'M<{@include inc}>[{@embed data}]', 'inc': 'v1', 'data': 'd1'}
+
+    def loader(cur_path, path):
+        return files[path], path
+
+    eng = yy.jump.Engine()
+    assert eng.render_path('main', loader=loader) == 'M<v1>[d1]'
+
+    # not cached, changes can't be detected
+    files['inc'] = 'v2'
+    files['data'] = 'd2'
+    assert eng.render_path('main', loader=loader) == 'M<v2>[d2]'
+    assert eng.cache.info()['size'] == 0
+
+
+def test_disk_cache(tmpdir, monkeypatch):
+    tmpdir.join('main').write('M<{@include inc}>{x}')
+    tmpdir.join('inc').write('1')
+    cache_dir = tmpdir.join('cache').strpath
+    main = tmpdir.join('main').strpath
+
+    assert yy.jump.Engine(cache_dir=cache_dir).render_path(main, {'x': 'X'}) == 'M<1>X'
+    assert len(tmpdir.join('cache').listdir()) == 1
+
+    def no_parse(self):
+        raise AssertionError('parse called')
+
+    # a fresh engine loads the code from disk
+
+    with monkeypatch.context() as m:
+        m.setattr(yy.jump.Compiler, 'parse', no_parse)
+        assert yy.jump.Engine(cache_dir=cache_dir).render_path(main, {'x': 'Y'}) == 'M<1>Y'
+
+    # stale include
+
+    tmpdir.join('inc').write('22')
+    assert yy.jump.Engine(cache_dir=cache_dir).render_path(main, {'x': 'X'}) == 'M<22>X'
+
+    with monkeypatch.context() as m:
+        m.setattr(yy.jump.Compiler, 'parse', no_parse)
+        assert yy.jump.Engine(cache_dir=cache_dir).render_path(main, {'x': 'X'}) == 'M<22>X'
+
+
+def test_disk_cache_fingerprint(tmpdir, monkeypatch):
+    # generated code calls the runtime, a change in either invalidates cached code
+    src = os.path.dirname(cache.compiler.__file__)
+    for name in ['compiler.py', 'engine.py']:
+        tmpdir.join(name).write(open(os.path.join(src, name)).read())
+
+    monkeypatch.setattr(cache.compiler, '__file__', tmpdir.join('compiler.py').strpath)
+    monkeypatch.setattr(cache, '_fingerprint_value', None)
+    fp = cache._fingerprint()
+
+    tmpdir.join('engine.py').write('# changed\n', mode='a')
+    monkeypatch.setattr(cache, '_fingerprint_value', None)
+    assert cache._fingerprint() != fp
+
+
+def test_disk_cache_pure_function_changed(tmpdir):
+    cache_dir = tmpdir.join('cache').strpath
+    t = "{'a' | upper}"
+
+    def engine(fn):
+        class E(yy.jump.Engine):
+            pure_functions = yy.jump.Engine.pure_functions
+            def_upper = fn
+        return E(cache_dir=cache_dir)
+
+    # folded outputs are in the cached code, a changed implementation invalidates it
+    assert engine(lambda self, v: v + '1').render(t) == 'a1'
+    assert engine(lambda self, v: v + '2').render(t) == 'a2'
+
+
+def test_disk_cache_text(tmpdir):
+    cache_dir = tmpdir.join('cache').strpath
+    assert yy.jump.Engine(cache_dir=cache_dir).render('{x}!', {'x': 1}) == '1!'
+    assert yy.jump.Engine(cache_dir=cache_dir).render('{x}!', {'x': 2}) == '2!'
+    assert yy.jump.Engine(cache_dir=cache_dir).render('{x}?', {'x': 3}) == '3?'
+    assert len(tmpdir.join('cache').listdir()) == 2
+
+
+def test_disk_cache_corrupt(tmpdir):
+    cache_dir = tmpdir.join('cache')
+    assert yy.jump.Engine(cache_dir=cache_dir.strpath).render('{x}', {'x': 1}) == '1'
+
+    for f in cache_dir.listdir():
+        f.write_binary(b'garbage')
+
+    assert yy.jump.Engine(cache_dir=cache_dir.strpath).render('{x}', {'x': 2}) == '2'
+    assert yy.jump.Engine(cache_dir=cache_dir.strpath).render('{x}', {'x': 3}) == '3'
+    assert [f.read_binary() != b'garbage' for f in cache_dir.listdir()] == [True]
+
+
+def test_preload(tmpdir, monkeypatch):
+    for n in range(6):
+        tmpdir.join(f't{n}.jump').write(f'T{n}<{{@include inc}}>')
+    tmpdir.join('inc').write('I')
+    tmpdir.join('bad.jump').write('@if')
+
+    eng = yy.jump.Engine()
+    res = eng.preload(tmpdir.strpath + '/*.jump', workers=2)
+
+    assert [r.path.split('/')[-1] for r in res] == ['bad.jump', 't0.jump', 't1.jump', 't2.jump', 't3.jump', 't4.jump', 't5.jump']
+    assert all(r.time > 0 for r in res)
+    assert isinstance(res[0].error, yy.jump.CompileError)
+    assert res[0].error.path.endswith('bad.jump')
+    assert res[0].error.line == 1
+    assert all(r.error is None for r in res[1:])
+
+    def no_parse(self):
+        raise AssertionError('parse called')
+
+    monkeypatch.setattr(yy.jump.Compiler, 'parse', no_parse)
+    assert eng.render_path(tmpdir.join('t3.jump').strpath) == 'T3<I>'
+    assert eng.cache.info()['size'] == 6
+
+    monkeypatch.undo()
+    tmpdir.join('inc').write('II')
+    assert eng.render_path(tmpdir.join('t3.jump').strpath) == 'T3<II>'
+
+
+def test_preload_serial(tmpdir):
+    tmpdir.join('a').write('{x}')
+    eng = yy.jump.Engine()
+    res = eng.preload([tmpdir.join('a').strpath, 'missing'], workers=0, strip=True)
+    assert res[0].error is None
+    assert 'cannot load' in res[1].error.message
+    assert eng.render_path(tmpdir.join('a').strpath, {'x': 1}, strip=True) == '1'
+    assert eng.cache.hits == 1
+
+
+def test_preload_loader_error(tmpdir):
+    def loader(cur_path, path):
+        if path == 'bad':
+            raise ValueError('broken loader')
+        return '{x}', path
+
+    eng = yy.jump.Engine()
+    res = eng.preload(['a', 'bad', 'b'], workers=0, loader=loader)
+    assert [r.path for r in res] == ['a', 'bad', 'b']
+    assert res[0].error is None and res[2].error is None
+    assert isinstance(res[1].error, ValueError)
+
+
+def _wait_for(fn, timeout=5):
+    t = time.time() + timeout
+    while time.time() < t:
+        if fn():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_watcher(tmpdir, caplog):
+    main = tmpdir.join('main')
+    main.write('M<{@include inc}>')
+    tmpdir.join('inc').write('1')
+
+    eng = yy.jump.Engine()
+    eng.watch(interval=0.01)
+    try:
+        assert eng.render_path(main.strpath) == 'M<1>'
+
+        tmpdir.join('inc').write('22')
+        assert _wait_for(lambda: eng.render_path(main.strpath) == 'M<22>')
+        assert eng.cache.misses == 1
+
+        # broken template keeps serving the old function, the error is logged once
+
+        tmpdir.join('inc').write('{@if}')
+        assert _wait_for(lambda: 'cannot recompile' in caplog.text)
+        time.sleep(0.1)
+        assert eng.render_path(main.strpath) == 'M<22>'
+        assert caplog.text.count('cannot recompile') == 1
+
+        tmpdir.join('inc').write('333')
+        assert _wait_for(lambda: eng.render_path(main.strpath) == 'M<333>')
+        assert eng.cache.misses == 1
+    finally:
+        eng.unwatch()
+
+    assert eng.watcher is None
+    assert eng.cache.check
+
+
+def test_watcher_loader_error(caplog):
+    files = {'main': 'v1'}
+    versions = {'main': 1}
+    fail = []
+
+    class Loader:
+        def __call__(self, cur_path, path):
+            if fail:
+                raise ValueError('broken loader')
+            return files[path], path
+
+        def version(self, path):
+            return versions[path]
+
+    ld = Loader()
+    eng = yy.jump.Engine()
+    eng.watch(interval=0.01)
+    try:
+        assert eng.render_path('main', loader=ld) == 'v1'
+
+        # an unexpected error is logged, and the watcher keeps running
+        fail.append(1)
+        files['main'] = 'v2'
+        versions['main'] = 2
+        assert _wait_for(lambda: 'broken loader' in caplog.text)
+        assert eng.render_path('main', loader=ld) == 'v1'
+
+        fail.clear()
+        assert _wait_for(lambda: eng.render_path('main', loader=ld) == 'v2')
+    finally:
+        eng.unwatch()
@@ -0,0 +1,49 @@
+from . import yy
+
+
+def test_check_collects_errors(tmpdir):
+    tmpdir.join('bad.jump').write("""\
+@if x +
+    {y +}
+@end
+@let = 3
+{z}
+@if 1
+""")
+    tmpdir.join('good.jump').write('@if 1\n{x}\n@end\n')
+
+    errors = yy.jump.check_paths(tmpdir.strpath, workers=0)
+    assert [(e.path.split('/')[-1], e.line) for e in errors] == [
+        ('bad.jump', 1),
+        ('bad.jump', 2),
+        ('bad.jump', 4),
+        ('bad.jump', 6),
+    ]
+    assert 'missing' in errors[-1].message
+
+
+def test_check_pool(tmpdir):
+    for n in range(8):
+        tmpdir.join(f't{n}.jump').write('ok\n' * n + '@unknown\n')
+    tmpdir.join('missing.tpl')
+
+    errors = yy.jump.check_paths([tmpdir.strpath + '/*.jump', tmpdir.strpath + '/nope'], workers=2)
+    assert [e.line for e in errors] == [1, 2, 3, 4, 5, 6, 7, 8, 1]
+    assert 'unknown command' in errors[0].message
+    assert 'cannot load' in errors[-1].message
+
+
+def test_check_translate(tmpdir):
+    tmpdir.join('a').write('A\n@def f(x, x)\n@end\n')
+    assert yy.jump.check_paths(tmpdir.join('a').strpath) == []
+    errors = yy.jump.check_paths(tmpdir.join('a').strpath, translate=True)
+    assert [e.line for e in errors] == [2]
+    assert 'duplicate argument' in errors[0].message
+
+
+def test_check_main(tmpdir, capsys):
+    tmpdir.join('a.jump').write('{x +}')
+    assert yy.jump.check.main([tmpdir.strpath, '--workers', '0']) == 1
+    assert 'a.jump' in capsys.readouterr().err
+    tmpdir.join('a.jump').write('{x}')
+    assert yy.jump.check.main([tmpdir.strpath]) == 0
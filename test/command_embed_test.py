@@ -0,0 +1,46 @@
+from . import yy
+
+
+def test_embed(tmpdir):
+    tmpdir.join('style.css').write('a { color: red }\n@if {x}\n')
+    tmpdir.join('main').write('<style>\n@embed style.css\n</style>{@embed "style.css"}\n')
+    main = tmpdir.join('main').strpath
+
+    eng = yy.jump.Engine()
+    assert eng.render_path(main) == '<style>\na { color: red }\n@if {x}\n</style>a { color: red }\n@if {x}\n\n'
+
+    python = eng.translate_path(main)
+    assert 'color' not in python
+
+    # the content is read when rendering, the template is not recompiled
+    tmpdir.join('style.css').write('b {}')
+    assert eng.render_path(main) == '<style>\nb {}</style>b {}\n'
+    assert eng.cache.misses == 1
+
+
+def test_embed_loader():
+    files = {'main': '[{@embed sub/a.svg}]', 'sub/a.svg': '<svg/>{x}'}
+    ld = yy.jump.DictLoader(files)
+    assert yy.jump.render_path('main', loader=ld) == '[<svg/>{x}]'
+
+    files['sub/a.svg'] = '<svg></svg>'
+    assert yy.jump.render_path('main', loader=ld) == '[<svg></svg>]'
+
+    def loader(cur_path, path):
+        return files[path], path
+
+    assert yy.jump.render_path('main', loader=loader) == '[<svg></svg>]'
+
+
+def test_embed_missing(tmpdir):
+    with yy.raises_compiler_error('cannot load'):
+        yy.jump.render('@embed missing.css')
+
+    tmpdir.join('a.js').write('1')
+    tmpdir.join('main').write('@embed a.js\n')
+    eng = yy.jump.Engine()
+    assert eng.render_path(tmpdir.join('main').strpath) == '1'
+
+    tmpdir.join('a.js').remove()
+    with yy.raises_runtime_error('main:1'):
+        eng.render_path(tmpdir.join('main').strpath)
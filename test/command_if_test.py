@@ -102,3 +102,58 @@ def test_if_and_for():
     assert yy.nows(s) == '12-a-3456-b-78'
 
 
+def test_elif_chain():
+    t = '@for k in keys\n@if k == 0\nzero\n'
+    t += ''.join(f'@elif k == {i}\n{{k}}\n' for i in range(1, 60))
+    t += '@elif k.nope\nnope\n@else\nother\n@end\n@end\n'
+    keys = [0, 1, 2, 59, 60]
+    expected = 'zero\n1\n2\n59\nother\n'
+
+    # condition errors are reported and count as false with an error handler
+    s, err = yy.render_err(t, {'keys': keys})
+    assert s == expected
+    assert err == ['AttributeError in <string> line 122']
+
+    s, err = yy.render_err(t, {'keys': keys[:4]})
+    assert s == expected[:-len('other\n')]
+    assert err == []
+
+    # the fail-fast variant uses native elif
+    with yy.raises_runtime_error('<string>:122'):
+        yy.render(t, {'keys': keys}, fail_fast=True)
+    assert yy.render(t, {'keys': keys[:4]}, fail_fast=True) == 'zero\n1\n2\n59\n'
+    fast = yy.jump.translate(t, fail_fast=True).split('def _RENDER__fail_fast')[1]
+    assert '_ENV.error' not in fast
+
+
+def test_assign_in_branch():
+    t = """
+        @if a > 3
+            @let a = 5
+            yes {a}
+        @elif b
+            @let b = 0
+            b {b}
+        @end
+    """
+    for opts in [{}, {'fail_fast': True}]:
+        assert yy.nows(yy.render(t, {'a': 4, 'b': 1}, **opts)) == 'yes5'
+        assert yy.nows(yy.render(t, {'a': 1, 'b': 1}, **opts)) == 'b0'
+        s, err = yy.render_err(t, {'a': 4, 'b': 1}, **opts)
+        assert yy.nows(s) == 'yes5'
+        assert err == []
+
+
+def test_nested_chains():
+    t = '@if a\n@if b\nAB\n@elif a\nA\n@end\n@elif b\nB\n@else\nN\n@end\n@if b\nb\n@end\n'
+    cases = [
+        ({'a': 1, 'b': 1}, 'AB\nb\n'),
+        ({'a': 1, 'b': 0}, 'A\n'),
+        ({'a': 0, 'b': 1}, 'B\nb\n'),
+        ({'a': 0, 'b': 0}, 'N\n'),
+    ]
+    for args, expected in cases:
+        assert yy.render(t, args) == expected
+        s, err = yy.render_err(t, args)
+        assert s == expected
+        assert err == []
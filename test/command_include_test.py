@@ -1,3 +1,5 @@
+import threading
+
 from . import yy
 
 
@@ -144,3 +146,189 @@ def test_error_location(tmpdir):
         'NameError in inc2 line 2',
         'NameError in main line 5'
     ]
+
+
+def test_error_location_many_includes():
+    files = {'main': ''.join(f'{n}<{{@include inc{n}}}>\n' for n in range(50))}
+    for n in range(50):
+        files[f'inc{n}'] = 'a\n{err}\n' if n % 10 == 0 else 'a\nb'
+
+    s, err = yy.render_err(None, path='main', loader=yy.jump.DictLoader(files))
+    assert err == [f'NameError in inc{n} line 2' for n in range(0, 50, 10)]
+
+
+def test_repeated_include_loaded_once():
+    files = {
+        'main': '@for n in [1, 2]\n@if n == 1\n@include inc\n@else\n@include inc\n@end\n@end\n',
+        'inc': '<{n}>\n{err}\n',
+    }
+    loads = []
+
+    def loader(cur_path, path):
+        loads.append(path)
+        return files[path], path
+
+    s, err = yy.render_err(None, path='main', loader=loader)
+    assert s == '<1>\n\n<2>\n\n'
+    assert err == ['NameError in inc line 2', 'NameError in inc line 2']
+    assert loads == ['main', 'inc']
+
+
+def test_include_resolved_loaded_once():
+    files = {
+        'main': '@include a\n@include sub/b\n',
+        'a': 'A\n',
+        'sub/b': '@include ../a\n@include a\n',
+    }
+    loads = []
+
+    class Loader(yy.jump.DictLoader):
+        def __call__(self, cur_path, path):
+            text, path = super().__call__(cur_path, path)
+            loads.append(path)
+            return text, path
+
+    s = yy.jump.render_path('main', loader=Loader(files))
+    assert s == 'A\nA\nA\n'
+    # the same file under different spellings is loaded once
+    assert loads == ['main', 'a', 'sub/b']
+
+
+def test_include_call_mode(tmpdir):
+    tmpdir.join('w').write('<w>{x}</w>\n{err}\n')
+    tmpdir.join('a').write('@for n in [1, 2]\n@include w\n@end\nA\n')
+    tmpdir.join('b').write('B{@include w}\n')
+
+    eng = yy.jump.Engine()
+    errors = []
+
+    def err(exc, path, line, env):
+        errors.append(f'{type(exc).__name__} in {path.split("/")[-1]} line {line}')
+        return True
+
+    a = eng.render_path(tmpdir.join('a').strpath, {'x': 1}, err, include_mode='call')
+    b = eng.render_path(tmpdir.join('b').strpath, {'x': 2}, err, include_mode='call')
+
+    assert a == '<w>1</w>\n\n<w>1</w>\n\nA\n'
+    assert b == 'B<w>2</w>\n\n\n'
+    assert errors == ['NameError in w line 2'] * 3
+    # the partial is compiled once and shared by both templates
+    assert eng.cache.info()['size'] == 3
+    python = yy.jump.translate_path(tmpdir.join('a').strpath, include_mode='call')
+    assert f"_PATHS = [{tmpdir.join('a').strpath!r}]" in python
+
+
+def test_include_call_mode_without_cache():
+    files = {'main': '@for n in [1, 2, 3]\n@include inc\n@end\n', 'inc': '<{n}>'}
+    loads = []
+
+    def loader(cur_path, path):
+        loads.append(path)
+        return files[path], path
+
+    # without the engine cache, the included template is compiled once per compile
+    for opts, extra in [({'cache_size': 0}, {}), ({}, {'extra': [1]})]:
+        loads.clear()
+        eng = yy.jump.Engine(**opts)
+        fn = eng.compile_path('main', include_mode='call', loader=loader, **extra)
+        assert eng.call(fn, {'n': 0}) == '<0><0><0>'
+        assert eng.call(fn, {'n': 0}) == '<0><0><0>'
+        assert loads == ['main', 'inc', 'inc']
+
+
+def test_include_call_mode_linked():
+    files = {'main': '@include a\n@include a\n', 'a': '<{@include b}>\n', 'b': 'B1'}
+    compiled = []
+
+    class Engine(yy.jump.Engine):
+        def compile_path(self, path, **options):
+            compiled.append(path)
+            return super().compile_path(path, **options)
+
+    eng = Engine()
+    loader = yy.jump.DictLoader(files)
+    assert eng.render_path('main', loader=loader, include_mode='call') == '<B1>\n<B1>\n'
+    assert eng.render_path('main', loader=loader, include_mode='call') == '<B1>\n<B1>\n'
+    # included functions are resolved when compiling, not on each call
+    assert compiled == ['main', 'main']
+
+    # a change in a nested include makes the top-level template stale
+    files['b'] = 'B2'
+    assert eng.render_path('main', loader=loader, include_mode='call') == '<B2>\n<B2>\n'
+
+
+def test_include_call_mode_recursive():
+    files = {'main': '@include r\n', 'r': '@if stack\n{stack.pop()}\n@include r2\n@end\n', 'r2': '@include r\n'}
+
+    def loader(cur_path, path):
+        return files[path], path
+
+    for eng in yy.jump.Engine(), yy.jump.Engine(cache_size=0):
+        fn = eng.compile_path('main', loader=loader, include_mode='call')
+        assert eng.call(fn, {'stack': [1, 2]}) == '2\n1\n'
+
+
+def test_include_call_mode_error_reported_once():
+    files = {'main': '@include a\n', 'a': 'A\n{x}\n'}
+    errors = []
+
+    def err(exc, path, line, env):
+        errors.append(f'{type(exc).__name__} in {path} line {line}')
+        return False
+
+    with yy.pytest.raises(NameError):
+        yy.jump.render_path('main', None, err, loader=yy.jump.DictLoader(files), include_mode='call')
+    assert errors == ['NameError in a line 2']
+
+
+def test_include_call_mode_errors(tmpdir):
+    tmpdir.join('w').write('{x}')
+    tmpdir.join('a').write('@include w\n')
+    eng = yy.jump.Engine()
+
+    with yy.raises_runtime_error("'x' is not defined"):
+        eng.render_path(tmpdir.join('a').strpath, include_mode='call')
+
+    tmpdir.join('w').write('{@if}')
+    with yy.raises_runtime_error('in .*/a:1'):
+        eng.render_path(tmpdir.join('a').strpath, include_mode='call')
+
+    with yy.raises_compiler_error('cannot load'):
+        eng.render('@include missing', include_mode='call')
+
+
+def test_prefetch():
+    files = {
+        'main': '@include a\n{@include b}\n@quote\n@include c\n@end\n@# @include c\n{@comment x}{@include c}{@end x}\n',
+        'a': 'A\n@include sub/x\n',
+        'b': 'B',
+        'c': 'C',
+        'sub/x': 'X\n@include y\n',
+        'sub/y': 'Y\n',
+    }
+    loads = []
+
+    def loader(cur_path, path):
+        if cur_path and '/' in cur_path:
+            path = cur_path.rsplit('/', 1)[0] + '/' + path
+        if path not in files:
+            raise FileNotFoundError(path)
+        loads.append((path, threading.current_thread() is threading.main_thread()))
+        return files[path], path
+
+    s = yy.jump.render_path('main', loader=loader, prefetch=4)
+    assert s == 'A\nX\nY\nB\n@include c\n\n'
+    # everything except the main template is loaded by the pool, quoted and commented includes are not loaded
+    assert sorted(loads) == [('a', False), ('b', False), ('main', True), ('sub/x', False), ('sub/y', False)]
+
+
+def test_prefetch_errors():
+    files = {'main': 'M\n@include a\n', 'a': '1\n@include missing\n'}
+
+    def loader(cur_path, path):
+        if path not in files:
+            raise FileNotFoundError(path)
+        return files[path], path
+
+    with yy.raises_compiler_error('cannot load.* in a:2'):
+        yy.jump.render_path('main', loader=loader, prefetch=4)
@@ -166,6 +166,16 @@ def test_escapes():
     assert yy.nows(s) == 'A{a}{b}B@if1B@end{abc}'
 
 
+def test_delimiters_in_text():
+    t = """\
+mail@example.com } {a}
+  a @if b @# c
+@# comment
+{@if 1}x{@end}@"""
+    s = yy.render(t, {'a': 'A'})
+    assert s == 'mail@example.com } A\n  a @if b @# c\nx@'
+
+
 def test_whitespace():
     t = """\
 abc
@@ -213,3 +223,37 @@ abc
                     ghi
 xyz
 """
+
+
+def test_parse_tree_locations():
+    t = """\
+{a}
+@if b
+    {c}
+@end
+"""
+    tree = yy.jump.parse(t)
+    locs = [(n.path_index, n.line_num) for n in tree.children if isinstance(n, yy.jump.compiler.Node.Location)]
+    assert locs == [(0, 1), (0, 1), (0, 2)]
+    assert not hasattr(tree.children[-1], '__dict__')
+
+
+def test_buffer_pieces():
+    buf = yy.jump.compiler.Buffer()
+    main, inc, inner = 'ab\ncd\n', 'X\nY', '1\n2\n'
+    buf.paste(main, 'main', 0)
+    buf.paste(inc, 'inc', 4)
+    buf.paste(inner, 'inner', 6)
+
+    assert buf.slice(0, buf.length) == 'ab\ncX\n1\n2\nYd\n'
+    # pasted texts are not copied
+    assert all(p[1] is main or p[1] is inc or p[1] is inner for p in buf.pieces)
+    assert len(buf.pieces) == 5
+
+    assert buf.find('Y', 0) == 10
+    assert buf.find('d', 0) == 11
+    assert buf.char(11) == 'd'
+    assert [buf.line_ref(p) for p in (0, 3, 4, 6, 8, 10, 11, 12)] == [
+        (0, 1), (0, 2), (1, 1), (2, 1), (2, 2), (1, 2), (1, 2), (1, 2)]
+    loc = buf.loc(3)
+    assert (loc.path, loc.line_num, loc.column) == ('main', 2, 0)
@@ -46,3 +46,87 @@ def test_allow_space():
 
     s = yy.render(t, {'aa': 11}, echo_start_whitespace=True)
     assert s == '11'
+
+
+def test_echo_run_with_text():
+    t = '<td a="{x}">{y}</td><td class=\'{{n}}\'>{n}\\</td>\n'
+    d = {'x': 'X{}"', 'y': None, 'n': 0}
+    expected = '<td a="X{}&#x22;"></td><td class=\'{n}\'>0\\</td>\n'
+
+    assert yy.render(t, d, filter='htmlq') == expected
+    s, err = yy.render_err(t, d, filter='htmlq')
+    assert s == expected
+
+    # written with one append in the fail-fast variant
+    fast = yy.jump.translate(t, fail_fast=True).split('def _RENDER__fail_fast')[1]
+    assert fast.count('_APPEND(') == 1
+
+
+def test_constant_echo_folded():
+    t = """@option filter = 'html'
+<h1>{'Profit & Lace'}</h1>
+{'=' * 3}|{[11 22 33] | join(':')}|{2 ** 10:,}|{'a' if 1 > 2 else 'b' | upper}|{x}
+"""
+    expected = '<h1>Profit &amp; Lace</h1>\n===|11:22:33|1,024|B|&lt;\n'
+
+    assert yy.render(t, {'x': '<'}) == expected
+    s, err = yy.render_err(t, {'x': '<'})
+    assert s == expected
+
+    python = yy.jump.translate(t)
+    assert "'Profit &amp; Lace'" in python
+    assert "'11:22:33'" in python
+    assert "_APPEND('<===>')" in yy.jump.translate("<{'=' * 3}>")
+
+    # template arguments still override functions
+    assert yy.render(t, {'x': 0, 'html': lambda v: str(v).lower()}) == '<h1>profit & lace</h1>\n===|11:22:33|1,024|b|0\n'
+
+    python = yy.jump.translate(t, optimize=False)
+    assert "'Profit &amp; Lace'" not in python
+
+
+def test_constant_echo_not_folded():
+    # errors are reported at run time, large values are not computed in advance
+    s, err = yy.render_err("{'a' | as_int}\n{'=' * 5000 | len}\n")
+    assert s == '\n5000\n'
+    assert err == ['ValueError in <string> line 1']
+
+    python = yy.jump.translate("{'=' * 5000}")
+    assert "'=' * 5000" in python
+
+    for t in ["{'%09999d' % 1}", "{1:09999}", "{1 | format('09999')}"]:
+        python = yy.jump.translate(t)
+        assert '_APPEND' in python and '9999' in python
+        assert len(python) < 5000
+    assert yy.render("{'%05d' % 1}{1:03}") == '00001001'
+    assert "'00001'" in yy.jump.translate("{'%05d' % 1}")
+    assert "'001'" in yy.jump.translate("{1:03}")
+
+
+def test_constant_echo_overridden_function():
+    class E1(yy.jump.Engine):
+        def def_upper(self, val):
+            return str(val).lower()
+
+    class E2(E1):
+        pure_functions = yy.jump.Engine.pure_functions
+
+    t = "{'Ab' | upper}"
+
+    # an override isn't folded unless the subclass redeclares `pure_functions`
+    python = E1().translate(t)
+    assert "'AB'" not in python and "'ab'" not in python
+    assert E1().render(t) == 'ab'
+
+    assert "'ab'" in E2().translate(t)
+    assert E2().render(t) == 'ab'
+
+
+def test_echo_run_size():
+    # large f-strings are slow to compile, long runs are split
+    t = '<p>{x}</p>\n' * 1000
+    fast = yy.jump.translate(t, fail_fast=True).split('def _RENDER__fail_fast')[1]
+    appends = [ln for ln in fast.split('\n') if '_APPEND(' in ln]
+    assert max(ln.count('!s}') for ln in appends) == yy.jump.compiler.C.PY_MAX_RUN_VALUES
+    assert sum(ln.count('!s}') for ln in appends) == 1000
+    assert yy.render(t, {'x': 1}, fail_fast=True) == '<p>1</p>\n' * 1000
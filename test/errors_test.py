@@ -46,3 +46,49 @@ def test_code():
 
     with yy.raises_runtime_error():
         yy.render(t, d)
+
+
+def test_no_var_in_function():
+    t = """
+        @def f()
+            {aa}
+        @end
+        {f()}
+        {aa}
+    """
+
+    s, err = yy.render_err(t, {}, path='PATH')
+    assert err == ['NameError in PATH line 3', 'NameError in PATH line 6']
+
+    with yy.raises_runtime_error("name 'aa' is not defined in PATH:3"):
+        yy.render(t, {}, path='PATH')
+
+
+def test_fail_fast_location(tmpdir):
+    tmpdir.join('inc').write('@def g(a)\n{a.x}\n@end\n')
+    tmpdir.join('main').write("""\
+ok {x}
+@include inc
+@for n in [1, 2]
+    @if n == 2
+        {g(n)}
+    @end
+@end
+""")
+    path = tmpdir.join('main').strpath
+
+    # compiled along with the template, used without an error handler
+    fn = yy.jump.compile_path(path, fail_fast=True)
+    assert fn.fail_fast.__code__.co_code != fn.__code__.co_code
+    assert yy.jump.compiler.fail_fast(fn) is fn.fail_fast
+
+    with yy.raises_runtime_error("'int' object has no attribute 'x' in .*inc:2"):
+        yy.jump.render_path(path, {'x': 1}, fail_fast=True)
+
+    s, err = yy.render_err(None, {'x': 1}, path=path, fail_fast=True)
+    assert err == ['AttributeError in inc line 2']
+
+    fn = yy.jump.compile_path(path)
+    assert yy.jump.compiler.fail_fast(fn) is fn
+    with yy.raises_runtime_error("in .*inc:2"):
+        yy.jump.render_path(path, {'x': 1})
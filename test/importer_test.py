@@ -0,0 +1,109 @@
+import importlib
+import os
+import sys
+import zipfile
+
+from . import yy
+
+from jump import importer
+
+
+def _with_path(tmpdir, fn):
+    sys.path.insert(0, tmpdir.strpath)
+    importer.install()
+    try:
+        return fn()
+    finally:
+        importer.uninstall()
+        sys.path.remove(tmpdir.strpath)
+
+
+def test_import_template(tmpdir, monkeypatch):
+    monkeypatch.setattr(sys, 'dont_write_bytecode', False)
+
+    pkg = tmpdir.mkdir('tpl_pkg_1')
+    pkg.join('__init__.py').write('')
+    pkg.join('hello.jump').write('Hello, {name}!')
+    pkg.join('other.tpl').write('{@include hello.jump}?')
+
+    def run():
+        from tpl_pkg_1 import hello, other
+        assert yy.jump.call(hello.render, {'name': 'Quark'}) == 'Hello, Quark!'
+        assert yy.jump.call(other.render, {'name': 'Rom'}) == 'Hello, Rom!?'
+
+    _with_path(tmpdir, run)
+
+    names = os.listdir(pkg.join('__pycache__').strpath)
+    assert any(n.startswith('hello.jump.') for n in names)
+    assert any(n.startswith('other.tpl.') for n in names)
+
+
+def test_regular_modules_take_precedence(tmpdir):
+    tmpdir.join('tpl_mod_2.py').write('render = "python"')
+    tmpdir.join('tpl_mod_2.jump').write('template')
+
+    def run():
+        return importlib.import_module('tpl_mod_2').render
+
+    assert _with_path(tmpdir, run) == 'python'
+
+
+def test_reload(tmpdir):
+    tmpdir.join('tpl_mod_3.jump').write('v1')
+
+    def run():
+        mod = importlib.import_module('tpl_mod_3')
+        assert yy.jump.call(mod.render) == 'v1'
+        tmpdir.join('tpl_mod_3.jump').write('version 2')
+        mod = importlib.reload(mod)
+        assert yy.jump.call(mod.render) == 'version 2'
+
+    _with_path(tmpdir, run)
+
+
+def test_not_installed(tmpdir):
+    tmpdir.join('tpl_mod_4.jump').write('x')
+    sys.path.insert(0, tmpdir.strpath)
+    try:
+        with yy.pytest.raises(ImportError):
+            importlib.import_module('tpl_mod_4')
+    finally:
+        sys.path.remove(tmpdir.strpath)
+
+
+def test_import_include_call_and_embed(tmpdir):
+    pkg = tmpdir.mkdir('tpl_pkg_5')
+    pkg.join('__init__.py').write('')
+    pkg.join('part.jump').write('P{x}')
+    pkg.join('data.txt').write('{x}')
+    pkg.join('page.jump').write("@option include_mode = 'call'\n<{@include part.jump}>[{@embed data.txt}]")
+
+    def run():
+        from tpl_pkg_5 import page
+        assert yy.jump.call(page.render, {'x': 1}) == '<P1>[{x}]'
+
+    _with_path(tmpdir, run)
+
+
+def test_import_from_zip(tmpdir):
+    archive = tmpdir.join('app.pyz').strpath
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('tpl_zip_6.jump', 'top {x}')
+        zf.writestr('tpl_pkg_6/__init__.py', '')
+        zf.writestr('tpl_pkg_6/part.jump', 'P{x}')
+        zf.writestr('tpl_pkg_6/data.txt', '{x}')
+        zf.writestr('tpl_pkg_6/page.jump', '<{@include part.jump}>[{@embed data.txt}]')
+        zf.writestr('tpl_pkg_6/call.tpl', "@option include_mode = 'call'\n<{@include part.jump}>")
+
+    sys.path.insert(0, archive)
+    importer.install()
+    try:
+        from tpl_pkg_6 import page, call
+        import tpl_zip_6
+        assert yy.jump.call(page.render, {'x': 1}) == '<P1>[{x}]'
+        assert yy.jump.call(call.render, {'x': 2}) == '<P2>'
+        assert yy.jump.call(tpl_zip_6.render, {'x': 3}) == 'top 3'
+        assert page.__file__ == os.path.join(archive, 'tpl_pkg_6', 'page.jump')
+    finally:
+        importer.uninstall()
+        sys.path.remove(archive)
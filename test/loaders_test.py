@@ -0,0 +1,106 @@
+import os
+import subprocess
+import sys
+
+from . import yy
+
+from jump import loaders
+
+
+def test_filesystem_search_path(tmpdir):
+    tmpdir.mkdir('a').join('main').write('M<{@include inc}>{@include common}')
+    tmpdir.join('a', 'inc').write('A-INC')
+    tmpdir.mkdir('b').join('inc').write('B-INC')
+    tmpdir.join('b', 'common').write('B-COMMON')
+
+    ld = yy.jump.FileSystemLoader([tmpdir.join('a').strpath, tmpdir.join('b').strpath])
+    assert yy.jump.render_path('main', loader=ld) == 'M<A-INC>B-COMMON'
+
+    with yy.raises_compiler_error('cannot load.*No such file'):
+        yy.jump.render_path('nope', loader=ld)
+
+
+def test_filesystem_relative_first(tmpdir):
+    tmpdir.mkdir('a').mkdir('sub').join('main').write('{@include inc}')
+    tmpdir.join('a', 'sub', 'inc').write('SUB')
+    tmpdir.join('a', 'inc').write('ROOT')
+
+    ld = yy.jump.FileSystemLoader(tmpdir.join('a').strpath)
+    assert yy.jump.render_path('sub/main', loader=ld) == 'SUB'
+
+
+def test_filesystem_caching(tmpdir, monkeypatch):
+    tmpdir.join('main').write('{@include inc}{@include inc}')
+    tmpdir.join('inc').write('x')
+
+    calls = []
+    os_stat = os.stat
+
+    def stat(path, *args, **kwargs):
+        calls.append(path)
+        return os_stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(loaders.os, 'stat', stat)
+
+    ld = yy.jump.FileSystemLoader(tmpdir.strpath, ttl=100)
+    eng = yy.jump.Engine(cache_size=0)
+    for _ in range(5):
+        assert eng.render_path('main', loader=ld) == 'xx'
+    assert len(calls) == 2
+
+    ld = yy.jump.FileSystemLoader(tmpdir.strpath, ttl=0)
+    calls.clear()
+    for _ in range(5):
+        assert eng.render_path('main', loader=ld) == 'xx'
+    assert len(calls) > 10
+
+
+def test_filesystem_version(tmpdir):
+    tmpdir.join('main').write('{@include inc}')
+    tmpdir.join('inc').write('1')
+
+    ld = yy.jump.FileSystemLoader(tmpdir.strpath, ttl=0)
+    eng = yy.jump.Engine()
+    assert eng.render_path('main', loader=ld) == '1'
+    tmpdir.join('inc').write('22')
+    assert eng.render_path('main', loader=ld) == '22'
+
+
+def test_dict_loader():
+    ld = yy.jump.DictLoader({
+        'main': 'M<{@include parts/a}>',
+        'parts/a': 'A<{@include b}>',
+        'parts/b': 'B',
+    })
+    eng = yy.jump.Engine()
+    assert eng.render_path('main', loader=ld) == 'M<A<B>>'
+
+    ld.templates['parts/b'] = 'BB'
+    assert eng.render_path('main', loader=ld) == 'M<A<BB>>'
+
+
+def test_dict_loader_version_stable():
+    # versions are compared across processes by the disk cache and preload
+    code = "import jump; print(jump.DictLoader({'a': 'text'}).version('a'))"
+    out = set()
+    for seed in ['1', '2']:
+        env = dict(os.environ, PYTHONHASHSEED=seed, PYTHONPATH=os.path.dirname(os.path.dirname(yy.jump.__file__)))
+        out.add(subprocess.check_output([sys.executable, '-c', code], env=env))
+    assert len(out) == 1
+
+
+def test_package_loader(tmpdir):
+    pkg = tmpdir.mkdir('tpl_loader_pkg')
+    pkg.join('__init__.py').write('')
+    pkg.mkdir('templates').join('main').write('M<{@include sub/a}>')
+    pkg.join('templates').mkdir('sub').join('a').write('A<{@include b}>')
+    pkg.join('templates', 'sub', 'b').write('B')
+
+    sys.path.insert(0, tmpdir.strpath)
+    try:
+        ld = yy.jump.PackageLoader('tpl_loader_pkg')
+        assert yy.jump.render_path('main', loader=ld) == 'M<A<B>>'
+        with yy.raises_compiler_error('cannot load'):
+            yy.jump.render_path('../__init__.py', loader=ld)
+    finally:
+        sys.path.remove(tmpdir.strpath)
@@ -0,0 +1,73 @@
+from . import yy
+
+TEMPLATE = """\
+<h1>{title}</h1>
+@if items
+    @for item in items
+        <li>{item}</li>
+    @end
+@end
+@let x = 1
+<p>{x}</p>
+@def f(a)
+    [{a}]
+@end
+@f 1
+"""
+
+
+def _dump(node):
+    if isinstance(node, list):
+        return [_dump(n) for n in node]
+    if type(node).__module__ != 'jump.compiler':
+        return node
+    d = {'': type(node).__name__}
+    for cls in type(node).__mro__:
+        for s in getattr(cls, '__slots__', ()):
+            if s != 'parse_state':
+                d[s] = _dump(getattr(node, s))
+    return d
+
+
+def _check_edit(text, offset, removed, inserted):
+    tree = yy.jump.parse(text)
+    new_text = text[:offset] + inserted + text[offset + removed:]
+    new_tree = yy.jump.reparse(tree, offset, removed, inserted)
+    assert _dump(new_tree) == _dump(yy.jump.parse(new_text))
+    return new_tree
+
+
+def test_reparse_text():
+    p = TEMPLATE.index('<p>')
+    _check_edit(TEMPLATE, p, 3, '<div>')
+
+
+def test_reparse_lines():
+    p = TEMPLATE.index('@let')
+    tree = _check_edit(TEMPLATE, p, 0, 'one\ntwo\n{three}\n')
+    assert tree.parse_state.text.count('\n') == TEMPLATE.count('\n') + 3
+
+
+def test_reparse_block_boundary():
+    p = TEMPLATE.index('@end\n@let')
+    _check_edit(TEMPLATE, p, len('@end\n@let x = 1\n'), '@let x = 1\n@end\n')
+    _check_edit(TEMPLATE, p, 0, '@end\n@if 1\n')
+
+
+def test_reparse_def_and_option():
+    p = TEMPLATE.index('(a)')
+    _check_edit(TEMPLATE, p, 3, '(a, b=2)')
+    _check_edit(TEMPLATE, TEMPLATE.index('@def'), 0, '@option strip=True\n')
+
+
+def test_reparse_error():
+    tree = yy.jump.parse(TEMPLATE)
+    p = TEMPLATE.index('@end')
+    with yy.raises_compiler_error('missing'):
+        yy.jump.reparse(tree, p, 4, '')
+
+
+def test_reparse_include(tmpdir):
+    tmpdir.join('inc').write('@if 1\nI\n@end\n')
+    text = '@include ' + tmpdir.join('inc').strpath + '\n<p>{x}</p>\n'
+    _check_edit(text, text.index('<p>'), 0, 'new\n')
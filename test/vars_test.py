@@ -89,3 +89,16 @@ def test_builtin_name():
     d = {}
     s = yy.render(t, d)
     assert s == '><built-in function len>abs5<'
+
+
+def test_name_precedence():
+    class Engine(yy.jump.Engine):
+        def def_len(self, val):
+            return 'LEN'
+
+        def def_upper(self, val):
+            return 'UPPER'
+
+    t = '{len(1)} {upper(1)} {abs(-1)} {x}\n@code\nARGS.upper = str.title\n@end\n{upper("a b")}'
+    s = Engine().render(t, {'len': lambda v: 'arg', 'x': 1})
+    assert s == 'arg UPPER 1 1\nA B'